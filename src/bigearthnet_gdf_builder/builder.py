@@ -1,10 +1,35 @@
+import collections
 import enum
+import functools
+import hashlib
+import itertools
+import json
+import math
+import os
+import re
 import shutil
+import tarfile
 import tempfile
+import time
+import urllib.parse
 import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
 from numbers import Real
-from pathlib import Path
-from typing import Callable, List, Tuple, Union
+from pathlib import Path, PurePath, PurePosixPath
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import requests
 
@@ -14,25 +39,63 @@ warnings.filterwarnings("ignore", category=UserWarning)
 import appdirs
 import fastcore.all as fc
 import geopandas
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pyproj
 import rich
 import typer
 from bigearthnet_common.base import (
-    get_original_split_from_patch_name,
-    get_s1_patch_directories,
-    get_s2_patch_directories,
-    is_cloudy_shadowy_patch,
-    is_snowy_patch,
+    get_s1_patches_from_original_test_split,
+    get_s1_patches_from_original_train_split,
+    get_s1_patches_from_original_validation_split,
+    get_s1_patches_with_cloud_and_shadow,
+    get_s1_patches_with_no_19_class_target,
+    get_s1_patches_with_seasonal_snow,
+    get_s2_patches_from_original_test_split,
+    get_s2_patches_from_original_train_split,
+    get_s2_patches_from_original_validation_split,
+    get_s2_patches_with_cloud_and_shadow,
+    get_s2_patches_with_no_19_class_target,
+    get_s2_patches_with_seasonal_snow,
     old2new_labels,
     parse_datetime,
     read_S1_json,
     read_S2_json,
 )
-from bigearthnet_common.constants import COUNTRIES, COUNTRIES_ISO_A2
-from fastcore.basics import compose
-from pydantic import DirectoryPath, FilePath, PositiveInt, conint, validate_arguments
+from bigearthnet_common.constants import (
+    BEN_S1_RE,
+    BEN_S1_V1_0_JSON_KEYS,
+    BEN_S2_RE,
+    BEN_S2_V1_0_JSON_KEYS,
+    COUNTRIES,
+    COUNTRIES_ISO_A2,
+    NEW_LABELS,
+    OLD_LABELS,
+    Split,
+)
+from numpy.typing import ArrayLike
+from pydantic import DirectoryPath, FilePath, PositiveInt, validate_arguments
 from rich.progress import Progress, SpinnerColumn, TextColumn, TimeElapsedColumn
-from shapely.geometry import LineString, Point, Polygon, box
+from shapely.geometry import Point, Polygon
+
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+try:
+    # shapely>=2 provides the vectorized pygeos API
+    from shapely import box as _vectorized_box
+    from shapely import polygons as _vectorized_polygons
+except ImportError:
+    from pygeos import box as _vectorized_box
+    from pygeos import polygons as _vectorized_polygons
 
 rich.traceback.install(show_locals=True)
 
@@ -41,6 +104,56 @@ COUNTRIES_URL = "https://www.naturalearthdata.com/http//www.naturalearthdata.com
 
 USER_DIR = Path(appdirs.user_data_dir("bigearthnet_gdf_builder"))
 USER_DIR.mkdir(exist_ok=True, parents=True)
+COUNTRIES_CACHE_DIR = USER_DIR / "country_borders"
+LISTINGS_DIR = USER_DIR / "listings"
+
+_COORDINATE_COLS = ["ulx", "uly", "lrx", "lry"]
+# columns with few distinct values that are stored as categoricals in the compact schema
+_CATEGORICAL_COLS = [
+    "country",
+    "season",
+    "original_split",
+    "tile_source",
+    "scene_source",
+    "acquisition_date",
+    "acquisition_time",
+]
+_BOOL_COLS = ["snow", "cloud_or_shadow"]
+# per-row bounding box of the spatially sorted output, see `spatially_sort_gdf`
+_BBOX_COLS = ["xmin", "ymin", "xmax", "ymax"]
+_SPATIAL_ROW_GROUP_SIZE = 10_000
+# hive partitioning of the partitioned output, see `write_partitioned_ben_parquet`
+_PARTITION_COLS = ["original_split", "country", "season"]
+_HIVE_NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+# Sentinel tiles, such as 33UUP, in the S2 `tile_source` and in the S1 patch `name`
+_S2_TILE_SOURCE_PATTERN = r"_T(\d{2}[A-Z]{3})_"
+_S1_NAME_TILE_PATTERN = r"^S1[AB]_\w+?_\d{8}T\d{6}_(\d{2}[A-Z]{3})_\d+_\d+$"
+# auto-tuning of the parallel parsing, see `_calibrate_parallel_settings`
+_CALIBRATION_SAMPLE_SIZE = 64
+_TARGET_CHUNK_SECONDS = 0.5
+_MIN_WORKER_SECONDS = 1.0
+_MIN_CHUNK_SIZE, _MAX_CHUNK_SIZE = 16, 4096
+
+
+def boxes_from_ul_lr_coords(
+    ulx: ArrayLike, uly: ArrayLike, lrx: ArrayLike, lry: ArrayLike
+) -> geopandas.array.GeometryArray:
+    """
+    Build boxes from arrays of upper left x/y and lower right x/y coordinates
+    with a single vectorized call.
+
+    This specification is the default BigEarthNet style.
+    The boxes have the same vertex order as `shapely.geometry.box`.
+    """
+    ulx, uly, lrx, lry = (np.asarray(c, dtype=float) for c in (ulx, uly, lrx, lry))
+    return geopandas.array.from_shapely(
+        _vectorized_box(
+            np.minimum(ulx, lrx),
+            np.minimum(uly, lry),
+            np.maximum(ulx, lrx),
+            np.maximum(uly, lry),
+        )
+    )
 
 
 def _get_box_from_two_coords(p1: Tuple[Real, Real], p2: Tuple[Real, Real]) -> Polygon:
@@ -48,9 +161,7 @@ def _get_box_from_two_coords(p1: Tuple[Real, Real], p2: Tuple[Real, Real]) -> Po
     Get the polygon that bounds the two coordinates.
     These values should be supplied as numerical values.
     """
-    get_bounds = lambda geom: geom.bounds
-    box_from_bounds = lambda bounds: box(*bounds)
-    return compose(LineString, get_bounds, box_from_bounds)([p1, p2])
+    return box_from_ul_lr_coords(*p1, *p2)
 
 
 def box_from_ul_lr_coords(ulx: Real, uly: Real, lrx: Real, lry: Real) -> Polygon:
@@ -58,8 +169,50 @@ def box_from_ul_lr_coords(ulx: Real, uly: Real, lrx: Real, lry: Real) -> Polygon
     Build a box (`Polygon`) from upper left x/y and lower right x/y coordinates.
 
     This specification is the default BigEarthNet style.
+    Thin wrapper around `boxes_from_ul_lr_coords`.
+    """
+    return boxes_from_ul_lr_coords([ulx], [uly], [lrx], [lry])[0]
+
+
+def _json_path_from_patch_path(patch_path: Path) -> Path:
+    """
+    Return the path to the `_labels_metadata.json` file of a patch.
+    `patch_path` may either point to the json file itself or to the
+    containing patch folder.
+    """
+    return (
+        patch_path
+        if patch_path.is_file()
+        else patch_path / f"{patch_path.name}_labels_metadata.json"
+    )
+
+
+def _ben_s2_patch_to_record(patch_path: Path) -> Dict[str, Any]:
+    """
+    Parse the json file of a single BEN-S2 patch into a flat dictionary.
+    The `coordinates` and `projection` entries are returned unchanged.
+    """
+    json_path = _json_path_from_patch_path(patch_path)
+    data = read_S2_json(json_path)
+    data["name"] = json_path.stem.rstrip("_labels_metadata")
+    data["acquisition_date"] = parse_datetime(data["acquisition_date"]).strftime(
+        "%Y-%m-%d %H:%M:%S"
+    )
+    return data
+
+
+def _ben_s1_patch_to_record(patch_path: Path) -> Dict[str, Any]:
+    """
+    Parse the json file of a single BEN-S1 patch into a flat dictionary.
+    The `coordinates` and `projection` entries are returned unchanged.
     """
-    return _get_box_from_two_coords([ulx, uly], [lrx, lry])
+    json_path = _json_path_from_patch_path(patch_path)
+    data = read_S1_json(json_path)
+    data["name"] = json_path.stem.rstrip("_labels_metadata")
+    data["acquisition_time"] = parse_datetime(data["acquisition_time"]).strftime(
+        "%Y-%m-%dT%H:%M:%S"
+    )
+    return data
 
 
 @validate_arguments
@@ -81,17 +234,7 @@ def ben_s2_patch_to_gdf(
     The coordinate reference system (CRS) will be equivalent to the one given in the json file.
     Or with other words, the data is not reprojected!
     """
-    json_path = (
-        patch_path
-        if patch_path.is_file()
-        else patch_path / f"{patch_path.name}_labels_metadata.json"
-    )
-
-    data = read_S2_json(json_path)
-    data["name"] = json_path.stem.rstrip("_labels_metadata")
-    data["acquisition_date"] = parse_datetime(data["acquisition_date"]).strftime(
-        "%Y-%m-%d %H:%M:%S"
-    )
+    data = _ben_s2_patch_to_record(patch_path)
     data["geometry"] = box_from_ul_lr_coords(**data.pop("coordinates"))
     data["labels"] = [data["labels"]]
     crs = data.pop("projection")
@@ -117,18 +260,7 @@ def ben_s1_patch_to_gdf(
     The coordinate reference system (CRS) will be equivalent to the one given in the json file.
     Or with other words, the data is not reprojected!
     """
-    json_path = (
-        patch_path
-        if patch_path.is_file()
-        else patch_path / f"{patch_path.name}_labels_metadata.json"
-    )
-
-    data = read_S1_json(json_path)
-    data["name"] = json_path.stem.rstrip("_labels_metadata")
-    data["acquisition_time"] = parse_datetime(data["acquisition_time"]).strftime(
-        "%Y-%m-%dT%H:%M:%S"
-    )
-
+    data = _ben_s1_patch_to_record(patch_path)
     data["geometry"] = box_from_ul_lr_coords(**data.pop("coordinates"))
     data["labels"] = [data["labels"]]
     crs = data.pop("projection")
@@ -165,40 +297,495 @@ def ben_s1_patch_to_reprojected_gdf(
     return ben_s1_patch_to_gdf(patch_path).to_crs(target_proj)
 
 
+def _records_to_columns(records: List[Dict[str, Any]]) -> Dict[str, list]:
+    """
+    Transpose parsed patch records into plain column lists.
+    The nested `coordinates` entry is flattened into the
+    `ulx`, `uly`, `lrx` and `lry` columns.
+    """
+    columns: Dict[str, list] = {}
+    for record in records:
+        record.update(record.pop("coordinates"))
+        for key, value in record.items():
+            columns.setdefault(key, []).append(value)
+    return columns
+
+
+def _parse_ben_json_record(
+    raw: bytes, json_path: PurePath, expected_keys: Set[str]
+) -> Dict[str, Any]:
+    """
+    Parse the `raw` content of the json file at `json_path`
+    with the fastest available json backend.
+    Only the `expected_keys` are kept and the `name` is added to the record.
+    """
+    try:
+        data = _json_loads(raw)
+    except ValueError as e:
+        raise ValueError("Error trying to read json from: ", json_path) from e
+    missing_elements = expected_keys - data.keys()
+    if len(missing_elements) > 0:
+        raise ValueError(f"{json_path} is missing entries!", missing_elements)
+    record = {k: v for k, v in data.items() if k in expected_keys}
+    record["name"] = json_path.stem.rstrip("_labels_metadata")
+    return record
+
+
+def _read_bytes_with_stats(path: Path) -> Tuple[bytes, os.stat_result]:
+    "Read the file at `path` together with the statistics of the opened file."
+    with open(path, "rb") as f:
+        return f.read(), os.fstat(f.fileno())
+
+
+def _read_ben_json_records(
+    patch_paths: List[Path],
+    expected_keys: Set[str],
+    io_threads: Optional[int] = None,
+    with_stats: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    Read the json files of the `patch_paths`.
+    Equivalent to `read_S2_json`/`read_S1_json` but without any per-file
+    argument validation or `is_file` checks:
+    A path that ends with `.json` is used directly, otherwise it is treated as the
+    patch directory.
+
+    If `io_threads` is given, the files are read concurrently with
+    `io_threads` threads before they are parsed.
+    If `with_stats` is set, the modification time and size of each opened json file
+    are added to its record as `json_mtime_ns` and `json_size`.
+    """
+    json_paths = [
+        patch_path
+        if patch_path.suffix == ".json"
+        else patch_path / f"{patch_path.name}_labels_metadata.json"
+        for patch_path in patch_paths
+    ]
+    reader = _read_bytes_with_stats if with_stats else Path.read_bytes
+    if io_threads is not None and io_threads > 1 and len(json_paths) > 1:
+        with ThreadPoolExecutor(min(io_threads, len(json_paths))) as executor:
+            raws = list(executor.map(reader, json_paths))
+    else:
+        raws = [reader(json_path) for json_path in json_paths]
+    if not with_stats:
+        return [
+            _parse_ben_json_record(raw, json_path, expected_keys)
+            for raw, json_path in zip(raws, json_paths)
+        ]
+    records = []
+    for (raw, stats), json_path in zip(raws, json_paths):
+        record = _parse_ben_json_record(raw, json_path, expected_keys)
+        record["json_mtime_ns"] = stats.st_mtime_ns
+        record["json_size"] = stats.st_size
+        records.append(record)
+    return records
+
+
+def _format_datetimes(values: List[str], fmt: str) -> List[str]:
+    """
+    Parse the datetime strings with `parse_datetime` and format them with `fmt`.
+    Each distinct value is only parsed once.
+    """
+    formatted = {v: parse_datetime(v).strftime(fmt) for v in set(values)}
+    return [formatted[v] for v in values]
+
+
+def _ben_s2_records_to_columns(records: List[Dict[str, Any]]) -> Dict[str, list]:
+    "Transpose the parsed BEN-S2 json records into column lists."
+    columns = _records_to_columns(records)
+    if len(records) > 0:
+        columns["acquisition_date"] = _format_datetimes(
+            columns["acquisition_date"], "%Y-%m-%d %H:%M:%S"
+        )
+    return columns
+
+
+def _ben_s1_records_to_columns(records: List[Dict[str, Any]]) -> Dict[str, list]:
+    "Transpose the parsed BEN-S1 json records into column lists."
+    for record in records:
+        # Silently fix the `lly` typo of the S1 coordinates, as `read_S1_json` does
+        coordinates = record["coordinates"]
+        if "lly" in coordinates:
+            coordinates["lry"] = coordinates.pop("lly")
+    columns = _records_to_columns(records)
+    if len(records) > 0:
+        columns["acquisition_time"] = _format_datetimes(
+            columns["acquisition_time"], "%Y-%m-%dT%H:%M:%S"
+        )
+    return columns
+
+
+@validate_arguments
+def read_ben_s2_json_columns(
+    patch_paths: List[Path],
+    io_threads: Optional[PositiveInt] = None,
+    with_stats: bool = False,
+) -> Dict[str, list]:
+    """
+    High-throughput reader for a batch of BEN-S2 patches.
+    The `patch_paths` may either point to the patch folders or to the json files.
+
+    Returns the parsed patches as a dictionary of column lists, where the
+    `coordinates` are flattened into the `ulx`, `uly`, `lrx` and `lry` columns.
+    The values are identical to the ones of `ben_s2_patch_to_gdf`, but the
+    arguments are only validated once per batch and `orjson` is used to parse
+    the json files if it is installed.
+    On high-latency file systems, `io_threads` keeps that many reads in flight.
+    If `with_stats` is set, the modification time and size of the json files
+    are added as the `json_mtime_ns` and `json_size` columns.
+    """
+    records = _read_ben_json_records(
+        patch_paths, BEN_S2_V1_0_JSON_KEYS, io_threads, with_stats
+    )
+    return _ben_s2_records_to_columns(records)
+
+
+@validate_arguments
+def read_ben_s1_json_columns(
+    patch_paths: List[Path],
+    io_threads: Optional[PositiveInt] = None,
+    with_stats: bool = False,
+) -> Dict[str, list]:
+    """
+    High-throughput reader for a batch of BEN-S1 patches.
+    The `patch_paths` may either point to the patch folders or to the json files.
+
+    Returns the parsed patches as a dictionary of column lists, where the
+    `coordinates` are flattened into the `ulx`, `uly`, `lrx` and `lry` columns.
+    The values are identical to the ones of `ben_s1_patch_to_gdf`, but the
+    arguments are only validated once per batch and `orjson` is used to parse
+    the json files if it is installed.
+    On high-latency file systems, `io_threads` keeps that many reads in flight.
+    If `with_stats` is set, the modification time and size of the json files
+    are added as the `json_mtime_ns` and `json_size` columns.
+    """
+    records = _read_ben_json_records(
+        patch_paths, BEN_S1_V1_0_JSON_KEYS, io_threads, with_stats
+    )
+    return _ben_s1_records_to_columns(records)
+
+
+def _iter_tar_json_records(
+    tar_path: Path,
+    pattern: re.Pattern,
+    expected_keys: Set[str],
+    name_filter: Optional[Callable[[str], bool]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the (compressed) tar archive at `tar_path` once and parse the
+    `*_labels_metadata.json` members of all patch folders whose name fully matches
+    `pattern` on the fly.
+    All other members, such as the image bands, are skipped without extracting them.
+    If `name_filter` is given, only the patches whose name passes the filter are parsed.
+    """
+    with tarfile.open(tar_path, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile() or not member.name.endswith(".json"):
+                continue
+            json_path = PurePosixPath(member.name)
+            patch_name = json_path.parent.name
+            if (
+                json_path.name != f"{patch_name}_labels_metadata.json"
+                or pattern.fullmatch(patch_name) is None
+                or (name_filter is not None and not name_filter(patch_name))
+            ):
+                continue
+            raw = tar.extractfile(member).read()
+            yield _parse_ben_json_record(raw, json_path, expected_keys)
+
+
+def _iter_tar_column_chunks(
+    tar_path: Path,
+    pattern: re.Pattern,
+    expected_keys: Set[str],
+    records_to_columns: Callable[[List[Dict[str, Any]]], Dict[str, list]],
+    chunk_size: int = 1024,
+    name_filter: Optional[Callable[[str], bool]] = None,
+) -> Iterator[Dict[str, list]]:
+    "Yield the patches of the tar archive as column lists in chunks of `chunk_size`."
+    records = _iter_tar_json_records(tar_path, pattern, expected_keys, name_filter)
+    for chunk in fc.chunked(records, chunk_sz=chunk_size):
+        yield records_to_columns(list(chunk))
+
+
+def _is_tar_archive(path: Path) -> bool:
+    "Check if `path` is a (compressed) tar archive."
+    return Path(path).is_file() and tarfile.is_tarfile(path)
+
+
+def _ben_s2_patches_to_columns(
+    paths: List[Path], io_threads: Optional[int] = None, with_stats: bool = False
+) -> Dict[str, list]:
+    "Parse a chunk of BEN-S2 patch paths into column lists."
+    return read_ben_s2_json_columns(paths, io_threads=io_threads, with_stats=with_stats)
+
+
+def _ben_s1_patches_to_columns(
+    paths: List[Path], io_threads: Optional[int] = None, with_stats: bool = False
+) -> Dict[str, list]:
+    "Parse a chunk of BEN-S1 patch paths into column lists."
+    return read_ben_s1_json_columns(paths, io_threads=io_threads, with_stats=with_stats)
+
+
+def _concat_column_chunks(chunks: List[Dict[str, list]]) -> pd.DataFrame:
+    """
+    Join the column lists of all chunks into a single `DataFrame`.
+    The order of the chunks and of the rows within each chunk is kept.
+    """
+    keys = chunks[0].keys()
+    return pd.DataFrame(
+        {k: list(itertools.chain.from_iterable(c[k] for c in chunks)) for k in keys}
+    )
+
+
+@functools.lru_cache()
+def _get_transformer(src_crs: str, target_crs: str) -> pyproj.Transformer:
+    """
+    Return a cached transformer from `src_crs` to `target_crs`.
+    The axis order is always x/y, as it is done by `GeoSeries.to_crs`.
+    """
+    return pyproj.Transformer.from_crs(src_crs, target_crs, always_xy=True)
+
+
+def _box_rings_from_ul_lr_coords(
+    ulx: np.ndarray, uly: np.ndarray, lrx: np.ndarray, lry: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the x and y coordinates of the closed exterior rings
+    of the boxes that are spanned by the upper left and lower right coordinates.
+    Both arrays have the shape `(n, 5)` and use the same vertex order
+    as `shapely.geometry.box`.
+    """
+    minx, maxx = np.minimum(ulx, lrx), np.maximum(ulx, lrx)
+    miny, maxy = np.minimum(uly, lry), np.maximum(uly, lry)
+    xs = np.stack([maxx, maxx, minx, minx, maxx], axis=1)
+    ys = np.stack([miny, maxy, maxy, miny, miny], axis=1)
+    return xs, ys
+
+
+def reproject_ul_lr_coords(
+    df: pd.DataFrame, target_proj: str = "epsg:3035"
+) -> geopandas.GeoSeries:
+    """
+    Build the reprojected boxes from the `ulx`, `uly`, `lrx` and `lry` columns
+    of `df`, where the source CRS of each row is given by the `projection` column.
+
+    The rows are grouped by their `projection` and the corner coordinates
+    of each group are transformed at once with a single cached transformer.
+    The result is identical to building each box in its source CRS
+    and calling `to_crs(target_proj)` on it.
+    """
+    coords = {c: df[c].to_numpy(dtype=float) for c in _COORDINATE_COLS}
+    xs, ys = _box_rings_from_ul_lr_coords(**coords)
+    for proj, idx in df.groupby("projection", sort=False).indices.items():
+        transformer = _get_transformer(proj, target_proj)
+        xs[idx], ys[idx] = transformer.transform(xs[idx], ys[idx])
+    geoms = geopandas.array.from_shapely(
+        _vectorized_polygons(np.stack([xs, ys], axis=-1))
+    )
+    return geopandas.GeoSeries(geoms, index=df.index, crs=target_proj)
+
+
+def _columns_to_gdf(df: pd.DataFrame, target_proj: str) -> geopandas.GeoDataFrame:
+    """
+    Build the `GeoDataFrame` from the parsed columns.
+    The geometries are reprojected to `target_proj` via `reproject_ul_lr_coords`.
+    The coordinate and projection columns are dropped.
+    """
+    geometry = reproject_ul_lr_coords(df, target_proj)
+    data = df.drop(columns=["projection", *_COORDINATE_COLS])
+    return geopandas.GeoDataFrame(data, geometry=geometry, crs=target_proj)
+
+
+def _with_io_threads(
+    columns_builder: Callable[..., Dict[str, list]],
+    n_workers: int,
+    io_workers: Optional[int],
+) -> Callable[[List[Path]], Dict[str, list]]:
+    """
+    Split the total I/O concurrency of `io_workers` concurrent reads
+    over the `n_workers` processes by passing the number of `io_threads`
+    to each call of `columns_builder`.
+    """
+    if io_workers is None:
+        return columns_builder
+    return functools.partial(
+        columns_builder, io_threads=max(1, math.ceil(io_workers / n_workers))
+    )
+
+
+def _available_cores() -> int:
+    "Number of cores that the current process may run on."
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _calibrate_parallel_settings(
+    paths: List[Path],
+    columns_builder: Callable[..., Dict[str, list]],
+    io_workers: Optional[int] = None,
+    clock: Callable[[], float] = time.perf_counter,
+) -> Tuple[int, int]:
+    """
+    Time `columns_builder` with the `clock` on a small sample that is spread
+    over `paths` and derive the number of workers and the chunk size from
+    the measured time per patch and the available cores.
+
+    A chunk should take about `_TARGET_CHUNK_SECONDS` to parse, which keeps the
+    communication overhead low without starving the workers.
+    Each worker should have at least `_MIN_WORKER_SECONDS` of work, as otherwise
+    the start-up costs of the process outweigh the gain.
+
+    Returns the tuple `(n_workers, chunk_size)`.
+    """
+    step = max(1, len(paths) // _CALIBRATION_SAMPLE_SIZE)
+    sample = paths[::step][:_CALIBRATION_SAMPLE_SIZE]
+    start = clock()
+    _with_io_threads(columns_builder, 1, io_workers)(sample)
+    seconds_per_patch = max((clock() - start) / len(sample), 1e-6)
+
+    chunk_size = int(
+        np.clip(
+            _TARGET_CHUNK_SECONDS / seconds_per_patch, _MIN_CHUNK_SIZE, _MAX_CHUNK_SIZE
+        )
+    )
+    n_chunks = math.ceil(len(paths) / chunk_size)
+    total_seconds = seconds_per_patch * len(paths)
+    n_workers = int(
+        np.clip(
+            total_seconds // _MIN_WORKER_SECONDS,
+            1,
+            min(_available_cores(), n_chunks),
+        )
+    )
+    return n_workers, chunk_size
+
+
+def _resolve_parallel_settings(
+    paths: List[Path],
+    columns_builder: Callable[..., Dict[str, list]],
+    n_workers: Optional[int],
+    chunk_size: Optional[int],
+    io_workers: Optional[int] = None,
+    verbose: bool = True,
+) -> Tuple[int, int]:
+    """
+    Replace the unset `n_workers` and `chunk_size` with the auto-tuned values
+    of `_calibrate_parallel_settings`.
+    If `verbose` is set, the auto-tuned settings are reported.
+    """
+    if (n_workers is not None and chunk_size is not None) or len(paths) == 0:
+        return n_workers or 1, chunk_size or 1024
+    tuned_workers, tuned_chunk_size = _calibrate_parallel_settings(
+        paths, columns_builder, io_workers
+    )
+    n_workers = n_workers or tuned_workers
+    chunk_size = chunk_size or tuned_chunk_size
+    if verbose:
+        rich.print(
+            f"[blue]Auto-tuned: {n_workers} worker(s) "
+            f"with chunks of {chunk_size} patches[/blue]"
+        )
+    return n_workers, chunk_size
+
+
 @validate_arguments
 def _parallel_gdf_path_builder(
     paths: List[Path],
-    gdf_builder: Callable[[Path, str], geopandas.GeoDataFrame],
-    n_workers: PositiveInt = 8,
+    columns_builder: Callable[[List[Path]], Dict[str, list]],
+    n_workers: Optional[PositiveInt] = None,
     progress: bool = True,
     target_proj: str = "epsg:3035",
+    chunk_size: Optional[PositiveInt] = None,
+    io_workers: Optional[PositiveInt] = None,
 ) -> geopandas.GeoDataFrame:
     """
     Build a single `geopandas.GeoDataFrame` by applying the
-    `gdf_builder` function in parallel with `n_worker` processes.
-    The `gdf_builder` function must take a path with a `target_proj`
-    and return a GeoDataFrame in that `target_proj` CRS!
+    `columns_builder` function in parallel with `n_worker` processes.
+    The `paths` are split into chunks of at most `chunk_size` patches.
+    The `columns_builder` function must take a list of paths
+    and return the parsed patches as a dictionary of column lists.
     By default a `progress` bar is shown.
-    Note that each individual gdf must already be reprojected to a
-    common CRS!
+
+    On high-latency file systems, such as NFS or Lustre, the throughput is
+    limited by the number of concurrent reads and not by the CPU.
+    If `io_workers` is given, up to `io_workers` json files are read concurrently
+    by threads, which are evenly distributed over the `n_workers` processes that
+    parse the files. The `columns_builder` must then accept the `io_threads` keyword.
+
+    If `n_workers` or `chunk_size` is not set, it is auto-tuned by timing
+    the `columns_builder` on a small sample of the `paths` first.
+    The chosen settings are reported if `progress` is set.
+
+    Each worker only sends one compact batch of plain columns per chunk
+    back and the `GeoDataFrame` is created a single time, with all
+    geometries reprojected to `target_proj`.
 
     If an empty dataframe is produced, an `ValueError` is raised.
     """
-    # TODO: Check if categorical variables can greatly reduce the size
-    # if this is the case, check if the unpacking performs as expected for the encoder
+    if len(paths) == 0:
+        raise ValueError("Empty gdf produced! Possible wrong folder?", paths)
 
-    # TODO understand how to set target_proj a positional variable
-    gdfs = fc.parallel(
-        gdf_builder,
-        paths,
+    n_workers, chunk_size = _resolve_parallel_settings(
+        paths, columns_builder, n_workers, chunk_size, io_workers, verbose=progress
+    )
+    # ensure that small inputs are still distributed over all workers
+    chunk_size = min(chunk_size, math.ceil(len(paths) / n_workers))
+    chunks = list(fc.chunked(paths, chunk_sz=chunk_size))
+    column_chunks = fc.parallel(
+        _with_io_threads(columns_builder, n_workers, io_workers),
+        chunks,
         progress=progress,
         n_workers=n_workers,
-        target_proj=target_proj,
     )
-    if len(gdfs) == 0:
-        raise ValueError("Empty gdf produced! Possible wrong folder?", paths)
-    gdf = pd.concat(gdfs, axis=0, ignore_index=True)
-    return gdf
+    df = _concat_column_chunks(column_chunks)
+    return _columns_to_gdf(df, target_proj)
+
+
+def _iter_parallel_gdf_chunks(
+    paths: List[Path],
+    columns_builder: Callable[[List[Path]], Dict[str, list]],
+    n_workers: Optional[PositiveInt] = None,
+    progress: bool = True,
+    target_proj: str = "epsg:3035",
+    chunk_size: Optional[PositiveInt] = None,
+    io_workers: Optional[PositiveInt] = None,
+    max_chunk_size: Optional[PositiveInt] = None,
+) -> Iterator[geopandas.GeoDataFrame]:
+    """
+    Lazily yield one `geopandas.GeoDataFrame` per chunk of at most `chunk_size` patches
+    in the order of `paths`.
+    The chunks are parsed by `columns_builder` with `n_workers` processes,
+    which read the files with `io_workers` threads in total, as in
+    `_parallel_gdf_path_builder`.
+
+    At most `2 * n_workers` chunks are in flight at the same time,
+    so the memory usage does not grow with the number of `paths`.
+    The unset `n_workers` and `chunk_size` are auto-tuned, where the
+    `chunk_size` is limited to `max_chunk_size`.
+    """
+    n_workers, chunk_size = _resolve_parallel_settings(
+        paths, columns_builder, n_workers, chunk_size, io_workers, verbose=progress
+    )
+    chunk_size = min(chunk_size, max_chunk_size or chunk_size)
+    columns_builder = _with_io_threads(columns_builder, n_workers, io_workers)
+    pending: collections.deque = collections.deque()
+    with ProcessPoolExecutor(n_workers) as executor, Progress(
+        *Progress.get_default_columns(), disable=not progress, transient=True
+    ) as progress_bar:
+        task = progress_bar.add_task(
+            "Parsing chunks", total=math.ceil(len(paths) / chunk_size)
+        )
+        chunks = fc.chunked(paths, chunk_sz=chunk_size)
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is not None:
+                pending.append(executor.submit(columns_builder, chunk))
+            while pending and (chunk is None or len(pending) >= 2 * n_workers):
+                columns = pending.popleft().result()
+                progress_bar.advance(task)
+                yield _columns_to_gdf(_concat_column_chunks([columns]), target_proj)
 
 
 @fc.delegates(_parallel_gdf_path_builder)
@@ -211,17 +798,23 @@ def build_gdf_from_s2_patch_paths(
     The code will run in parallel and use `n_workers` processes.
     By default a progress-bar will be shown.
 
-    From personal experience, the ideal number of workers is 8 in most cases.
-    For laptops with fewer cores, 2 or 4 `n_workers` should be set.
-    More than 8 usually leads to only minor improvements and with n_workers > 12
-    the performance usually degrades.
+    Each worker parses `chunk_size` patches at once, which greatly reduces
+    the communication overhead for large inputs.
+    By default, `n_workers` and `chunk_size` are auto-tuned from the available cores
+    and the parsing speed on a small sample of the `paths`.
+    The tuned number of workers is limited by the available cores and by the number
+    of chunks, and each worker is given at least about a second of parsing work,
+    so small inputs are parsed by fewer processes.
+    Set `n_workers` explicitly to use a fixed number of processes instead.
+    On network file systems, `io_workers` sets the number of concurrent json reads
+    independently of the number of processes.
 
     The function returns a single GDF with all patches reprojected to `target_proj`,
     which is `epsg:3035` by default.
 
     If the directory contains no S2 patch-folders, an `ValueError` is raised.
     """
-    return _parallel_gdf_path_builder(paths, ben_s2_patch_to_reprojected_gdf, **kwargs)
+    return _parallel_gdf_path_builder(paths, _ben_s2_patches_to_columns, **kwargs)
 
 
 @fc.delegates(_parallel_gdf_path_builder)
@@ -234,17 +827,95 @@ def build_gdf_from_s1_patch_paths(
     The code will run in parallel and use `n_workers` processes.
     By default a progress-bar will be shown.
 
-    From personal experience, the ideal number of workers is 8 in most cases.
-    For laptops with fewer cores, 2 or 4 `n_workers` should be set.
-    More than 8 usually leads to only minor improvements and with n_workers > 12
-    the performance usually degrades.
+    Each worker parses `chunk_size` patches at once, which greatly reduces
+    the communication overhead for large inputs.
+    By default, `n_workers` and `chunk_size` are auto-tuned from the available cores
+    and the parsing speed on a small sample of the `paths`.
+    The tuned number of workers is limited by the available cores and by the number
+    of chunks, and each worker is given at least about a second of parsing work,
+    so small inputs are parsed by fewer processes.
+    Set `n_workers` explicitly to use a fixed number of processes instead.
+    On network file systems, `io_workers` sets the number of concurrent json reads
+    independently of the number of processes.
 
     The function returns a single GDF with all patches reprojected to `target_proj`,
     which is `epsg:3035` by default.
 
     If the directory contains no S2 patch-folders, an `ValueError` is raised.
     """
-    return _parallel_gdf_path_builder(paths, ben_s1_patch_to_reprojected_gdf, **kwargs)
+    return _parallel_gdf_path_builder(paths, _ben_s1_patches_to_columns, **kwargs)
+
+
+def _scan_patch_names(dir_path: Path, pattern: re.Pattern) -> List[str]:
+    """
+    List the names of all entries of `dir_path` that fully match `pattern`.
+    The entries are only validated by their name and are never `stat`-ed.
+    """
+    with os.scandir(dir_path) as entries:
+        return [e.name for e in entries if pattern.fullmatch(e.name) is not None]
+
+
+def _listing_index_path(dir_path: Path, kind: str) -> Path:
+    "Path of the cached listing index of the `kind` patches in `dir_path`."
+    digest = hashlib.sha256(str(dir_path).encode("utf-8")).hexdigest()[:16]
+    return LISTINGS_DIR / f"{kind}_{digest}.json"
+
+
+def _discover_patch_directories(
+    dir_path: Path, pattern: re.Pattern, kind: str, use_index: bool
+) -> List[Path]:
+    """
+    Shared logic of `discover_s2_patch_directories` and `discover_s1_patch_directories`.
+    The listing index stores the patch names together with the modification time
+    of `dir_path`, which changes whenever an entry is added or removed.
+    """
+    resolved_path = dir_path.resolve(strict=True)
+    mtime_ns = resolved_path.stat().st_mtime_ns
+    index_path = _listing_index_path(resolved_path, kind)
+    if use_index and index_path.exists():
+        try:
+            index = _json_loads(index_path.read_bytes())
+        except ValueError:
+            index = {}
+        if index.get("dir") == str(resolved_path) and index.get("mtime_ns") == mtime_ns:
+            return [dir_path / name for name in index["names"]]
+
+    names = _scan_patch_names(resolved_path, pattern)
+    if use_index:
+        index_path.parent.mkdir(exist_ok=True, parents=True)
+        index = {"dir": str(resolved_path), "mtime_ns": mtime_ns, "names": names}
+        index_path.write_text(json.dumps(index))
+    return [dir_path / name for name in names]
+
+
+@validate_arguments
+def discover_s2_patch_directories(
+    dir_path: DirectoryPath, use_index: bool = True
+) -> List[Path]:
+    """
+    Fast drop-in replacement for `get_s2_patch_directories`.
+    Finds all S2 patch directories in `dir_path` with a single `os.scandir` pass,
+    which only validates the names of the entries.
+
+    If `use_index` is set, the listing is cached in the `USER_DIR` and reused
+    as long as the modification time of `dir_path` is unchanged.
+    """
+    return _discover_patch_directories(dir_path, BEN_S2_RE, "s2", use_index)
+
+
+@validate_arguments
+def discover_s1_patch_directories(
+    dir_path: DirectoryPath, use_index: bool = True
+) -> List[Path]:
+    """
+    Fast drop-in replacement for `get_s1_patch_directories`.
+    Finds all S1 patch directories in `dir_path` with a single `os.scandir` pass,
+    which only validates the names of the entries.
+
+    If `use_index` is set, the listing is cached in the `USER_DIR` and reused
+    as long as the modification time of `dir_path` is unchanged.
+    """
+    return _discover_patch_directories(dir_path, BEN_S1_RE, "s1", use_index)
 
 
 @fc.delegates(build_gdf_from_s2_patch_paths)
@@ -254,11 +925,11 @@ def get_gdf_from_s2_patch_dir(
     """
     Searches through `dir_path` to assemble a BEN-S2-style `GeoDataFrame`.
     Will only consider correctly named directories.
-    Wraps around `get_s2_patch_directory` and `build_gdf_from_s2_patch_paths`.
+    Wraps around `discover_s2_patch_directories` and `build_gdf_from_s2_patch_paths`.
 
     Raises an error if an empty GeoDataFrame would be produced.
     """
-    patch_paths = get_s2_patch_directories(dir_path)
+    patch_paths = discover_s2_patch_directories(dir_path)
     gdf = build_gdf_from_s2_patch_paths(patch_paths, **kwargs)
     if len(gdf) == 0:
         raise ValueError("Empty gdf produced! Check provided directory!")
@@ -272,20 +943,25 @@ def get_gdf_from_s1_patch_dir(
     """
     Searches through `dir_path` to assemble a BEN-S1-style `GeoDataFrame`.
     Will only consider correctly named directories.
-    Wraps around `get_s1_patch_directory` and `build_gdf_from_s1_patch_paths`.
+    Wraps around `discover_s1_patch_directories` and `build_gdf_from_s1_patch_paths`.
 
     Raises an error if an empty GeoDataFrame would be produced.
     """
-    patch_paths = get_s1_patch_directories(dir_path)
+    patch_paths = discover_s1_patch_directories(dir_path)
     gdf = build_gdf_from_s1_patch_paths(patch_paths, **kwargs)
     if len(gdf) == 0:
         raise ValueError("Empty gdf produced! Check provided directory!")
     return gdf
 
 
-# @functools.lru_cache()
-def _get_country_borders() -> geopandas.GeoDataFrame:
-    "Get all country borders"
+def _get_country_borders(borders_path: Optional[Path] = None) -> geopandas.GeoDataFrame:
+    """
+    Get all country borders.
+    By default, the naturalearthdata 10m-admin-0-countries dataset is downloaded.
+    If `borders_path` is given, the borders are read from this local file instead.
+    It may either be a GeoParquet file or any file that is supported by
+    `geopandas.read_file`, such as the zipped shapefile from naturalearthdata.
+    """
     # directly filter out irrelevant lines
     rel_cols = [
         "ISO_A3",
@@ -294,22 +970,29 @@ def _get_country_borders() -> geopandas.GeoDataFrame:
         "geometry",
     ]
 
-    # Now requires to provide some valid user-agent header
-    # gdf = geopandas.read_file(COUNTRIES_URL)
-    with tempfile.TemporaryFile() as fp:
-        resp = requests.get(
-            COUNTRIES_URL,
-            headers={
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36"
-            },
-        )
-        if resp.status_code != 200:
-            raise RuntimeError(
-                "Error downloading reference shapefile. Probably due to some server issues."
+    if borders_path is not None:
+        borders_path = Path(borders_path).resolve(strict=True)
+        if borders_path.suffix == ".parquet":
+            gdf = geopandas.read_parquet(borders_path)
+        else:
+            gdf = geopandas.read_file(borders_path)
+    else:
+        # Now requires to provide some valid user-agent header
+        # gdf = geopandas.read_file(COUNTRIES_URL)
+        with tempfile.TemporaryFile() as fp:
+            resp = requests.get(
+                COUNTRIES_URL,
+                headers={
+                    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36"
+                },
             )
-        fp.write(resp.content)
-        fp.seek(0)
-        gdf = geopandas.read_file(fp)
+            if resp.status_code != 200:
+                raise RuntimeError(
+                    "Error downloading reference shapefile. Probably due to some server issues."
+                )
+            fp.write(resp.content)
+            fp.seek(0)
+            gdf = geopandas.read_file(fp)
 
     # NOTE: Update to the admin naturalearthdataset has removed the
     # ISO_A2 label for Kosovo, to remain compatible with previous version,
@@ -320,22 +1003,277 @@ def _get_country_borders() -> geopandas.GeoDataFrame:
     return gdf[rel_cols]
 
 
-def get_ben_countries_gdf() -> geopandas.GeoDataFrame:
+def _sha256sum(path: Path) -> str:
+    "Return the hex digest of the SHA-256 checksum of the file at `path`."
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _crs_tag(crs: str) -> str:
+    "Return a string that identifies `crs` and can be used as part of a file name."
+    tag = pyproj.CRS.from_user_input(crs).to_string().replace(":", "_").lower()
+    if not tag.isidentifier():
+        tag = hashlib.sha256(tag.encode("utf-8")).hexdigest()[:16]
+    return tag
+
+
+def _countries_cache_path(crs: Optional[str]) -> Path:
+    """
+    Path of the cached BEN country borders in the `crs` projection.
+    If `crs` is `None`, the path of the borders in the original CRS is returned.
+    """
+    tag = "source" if crs is None else _crs_tag(crs)
+    return COUNTRIES_CACHE_DIR / f"ben_countries_{tag}.parquet"
+
+
+def _read_cached_gdf(path: Path) -> Optional[geopandas.GeoDataFrame]:
+    """
+    Read the cached GeoParquet file at `path`.
+    Returns `None` if the file or its checksum file do not exist
+    or if the checksum does not match.
+    """
+    checksum_path = path.with_suffix(".sha256")
+    if not (path.exists() and checksum_path.exists()):
+        return None
+    if _sha256sum(path) != checksum_path.read_text().strip():
+        warnings.warn(f"Ignoring corrupted cache file: {path}", RuntimeWarning)
+        return None
+    return geopandas.read_parquet(path)
+
+
+def _replace_atomically(path: Path, write: Callable[[Path], Any]) -> None:
+    """
+    Call `write` with a temporary path next to `path` and move the written file
+    to `path` with `os.replace`, so concurrent readers never see a partially
+    written file.
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix=path.suffix, dir=path.parent)
+    os.close(fd)
+    try:
+        write(Path(tmp_path))
+        os.replace(tmp_path, path)
+    finally:
+        Path(tmp_path).unlink(missing_ok=True)
+
+
+def _write_cached_gdf(gdf: geopandas.GeoDataFrame, path: Path) -> None:
+    "Atomically write `gdf` to the cache `path` together with its checksum file."
+    path.parent.mkdir(exist_ok=True, parents=True)
+    _replace_atomically(path, gdf.to_parquet)
+    checksum = _sha256sum(path)
+    _replace_atomically(path.with_suffix(".sha256"), lambda p: p.write_text(checksum))
+
+
+@functools.lru_cache()
+def _load_ben_countries_gdf(crs: Optional[str] = None) -> geopandas.GeoDataFrame:
+    """
+    Load the BEN country borders in the `crs` projection.
+    The result is memoized per `crs` and persisted in the `COUNTRIES_CACHE_DIR`,
+    so that the borders only have to be downloaded and reprojected once.
+    """
+    path = _countries_cache_path(crs)
+    gdf = _read_cached_gdf(path)
+    if gdf is None:
+        if crs is None:
+            borders = _get_country_borders()
+            gdf = borders[borders["ISO_A2"].isin(COUNTRIES_ISO_A2)]
+        else:
+            gdf = _load_ben_countries_gdf(None).to_crs(crs)
+        _write_cached_gdf(gdf, path)
+    return gdf
+
+
+def get_ben_countries_gdf(crs: Optional[str] = None) -> geopandas.GeoDataFrame:
     """
     Return a `GeoDataFrame` that includes the shapes of each
     country from the BigEarthNet dataset.
+    If `crs` is given, the shapes are reprojected to `crs`.
 
     This is a subset of the naturalearthdata 10m-admin-0-countries dataset:
 
     https://www.naturalearthdata.com/downloads/10m-cultural-vectors/10m-admin-0-countries
+
+    The subset is only downloaded on the first call and cached in the `USER_DIR`.
+    Use `cache_ben_countries` to populate the cache from a local file
+    on machines without internet access.
+    """
+    return _load_ben_countries_gdf(crs).copy()
+
+
+def cache_ben_countries(
+    borders_path: Optional[Path] = None,
+    crs: str = "epsg:3035",
+    verbose: bool = True,
+) -> Path:
+    """
+    (Re-)build the cache of the BigEarthNet country borders.
+
+    If `borders_path` is given, the borders are read from this local
+    naturalearthdata 10m-admin-0-countries file (zipped shapefile or GeoParquet).
+    Otherwise, the file is downloaded.
+    The borders are additionally cached in the `crs` projection.
+    The previous cache is only replaced once the new borders have been loaded,
+    so a failing download or an invalid `borders_path` keeps the working cache.
+
+    Returns the cache directory.
+    """
+    borders = _get_country_borders(borders_path)
+    ben_borders = borders[borders["ISO_A2"].isin(COUNTRIES_ISO_A2)]
+    reprojected_borders = ben_borders.to_crs(crs)
+    for path in COUNTRIES_CACHE_DIR.glob("ben_countries_*"):
+        path.unlink()
+    _load_ben_countries_gdf.cache_clear()
+    _write_cached_gdf(ben_borders, _countries_cache_path(None))
+    _write_cached_gdf(reprojected_borders, _countries_cache_path(crs))
+    if verbose:
+        rich.print(f"[green]Country borders cached in:\n {COUNTRIES_CACHE_DIR}[/green]")
+    return COUNTRIES_CACHE_DIR
+
+
+def _assign_points_to_borders(
+    points: geopandas.GeoSeries, borders: geopandas.GeoDataFrame
+) -> np.ndarray:
+    """
+    Return the `NAME` of the border that contains each point.
+    The containing borders are found with a single bulk query against the spatial index.
+    Only the points that do not lie strictly inside of a border, such as points
+    on the coast or on the border itself, are assigned to the nearest border.
+    """
+    names = np.full(len(points), None, dtype=object)
+    border_names = borders["NAME"].to_numpy()
+    sindex = borders.sindex
+    query_bulk = getattr(sindex, "query_bulk", sindex.query)
+    point_idx, border_idx = query_bulk(points.values, predicate="within")
+    # keep the first match if a point would lie within overlapping borders
+    point_idx, first = np.unique(point_idx, return_index=True)
+    names[point_idx] = border_names[border_idx[first]]
+
+    miss_idx = np.flatnonzero(pd.isna(names))
+    if len(miss_idx) > 0:
+        misses = geopandas.GeoDataFrame(
+            geometry=points.iloc[miss_idx].reset_index(drop=True), crs=points.crs
+        )
+        nn_gdf = misses.sjoin_nearest(borders[["NAME", "geometry"]], how="inner")
+        nn_gdf = nn_gdf[~nn_gdf.index.duplicated()]
+        names[miss_idx[nn_gdf.index]] = nn_gdf["NAME"].to_numpy()
+    return names
+
+
+def _get_tile_ids(gdf: pd.DataFrame) -> np.ndarray:
+    """
+    Extract the Sentinel tile of each BigEarthNet patch.
+    For S2 patches the tile is parsed from the `tile_source` column and
+    for S1 patches from the `name` column.
+    Entries without a known tile are `None`.
+    """
+    if "tile_source" in gdf.columns:
+        tiles = gdf["tile_source"].astype(str).str.extract(_S2_TILE_SOURCE_PATTERN)[0]
+    elif "name" in gdf.columns:
+        tiles = gdf["name"].astype(str).str.extract(_S1_NAME_TILE_PATTERN)[0]
+    else:
+        return np.full(len(gdf), None, dtype=object)
+    return tiles.where(tiles.notna(), None).to_numpy(dtype=object)
+
+
+def _tile_table_path(crs: str) -> Path:
+    "Path of the cached tile-to-country table in the `crs` projection."
+    return COUNTRIES_CACHE_DIR / f"ben_countries_tiles_{_crs_tag(crs)}.parquet"
+
+
+def _get_tile_countries(
+    tile_ids: np.ndarray,
+    points: geopandas.GeoSeries,
+    borders: geopandas.GeoDataFrame,
+    crs: str,
+    persist: bool = True,
+) -> np.ndarray:
+    """
+    Return the country of each point whose tile lies entirely within a single country
+    and `None` for all other points.
+
+    The extent of each tile is the bounding box of all points of the tile
+    that have been seen so far.
+    Only tiles whose extent is not yet covered by the tile-to-country table are checked
+    against the `borders`.
+    If `persist` is set, the table is atomically replaced next to the cached
+    country borders.
     """
-    borders = _get_country_borders()
-    ben_borders = borders[borders["ISO_A2"].isin(COUNTRIES_ISO_A2)].copy()
-    return ben_borders
+    names = np.full(len(tile_ids), None, dtype=object)
+    known = np.flatnonzero(pd.notna(tile_ids))
+    if len(known) == 0:
+        return names
+    extents = (
+        pd.DataFrame(
+            {
+                "tile": tile_ids[known],
+                "x": points.x.to_numpy()[known],
+                "y": points.y.to_numpy()[known],
+            }
+        )
+        .groupby("tile")
+        .agg(minx=("x", "min"), miny=("y", "min"), maxx=("x", "max"), maxy=("y", "max"))
+    )
+
+    path = _tile_table_path(crs)
+    if persist and path.exists():
+        table = pd.read_parquet(path).set_index("tile")
+    else:
+        table = pd.DataFrame(
+            columns=["minx", "miny", "maxx", "maxy", "country"],
+            index=pd.Index([], name="tile"),
+        )
+    cached = table.reindex(extents.index)
+    covered = (
+        (cached["minx"] <= extents["minx"])
+        & (cached["miny"] <= extents["miny"])
+        & (cached["maxx"] >= extents["maxx"])
+        & (cached["maxy"] >= extents["maxy"])
+    )
+    outdated = extents.index[~covered]
+    if len(outdated) > 0:
+        ext = extents.loc[outdated]
+        prev = cached.loc[outdated].astype({c: float for c in ext.columns})
+        ext = pd.DataFrame(
+            {
+                "minx": np.fmin(ext["minx"], prev["minx"]),
+                "miny": np.fmin(ext["miny"], prev["miny"]),
+                "maxx": np.fmax(ext["maxx"], prev["maxx"]),
+                "maxy": np.fmax(ext["maxy"], prev["maxy"]),
+            }
+        )
+        boxes = geopandas.GeoSeries(
+            boxes_from_ul_lr_coords(ext["minx"], ext["maxy"], ext["maxx"], ext["miny"]),
+            crs=crs,
+        )
+        sindex = boxes.sindex
+        query_bulk = getattr(sindex, "query_bulk", sindex.query)
+        border_idx, box_idx = query_bulk(
+            borders.geometry.values, predicate="contains_properly"
+        )
+        countries = np.full(len(ext), None, dtype=object)
+        countries[box_idx] = borders["NAME"].to_numpy()[border_idx]
+        # a tile that would lie in overlapping borders remains ambiguous
+        box_ids, counts = np.unique(box_idx, return_counts=True)
+        countries[box_ids[counts > 1]] = None
+        ext["country"] = countries
+        table = pd.concat([table.drop(index=outdated, errors="ignore"), ext])
+        if persist:
+            path.parent.mkdir(exist_ok=True, parents=True)
+            _replace_atomically(
+                path, table.rename_axis("tile").reset_index().to_parquet
+            )
+
+    names[known] = table["country"].reindex(tile_ids[known]).to_numpy(dtype=object)
+    return names
 
 
 def assign_to_ben_country(
-    gdf: geopandas.GeoDataFrame, crs: str = "epsg:3035"
+    gdf: geopandas.GeoDataFrame,
+    crs: str = "epsg:3035",
+    simplify_tolerance: Optional[float] = None,
 ) -> geopandas.GeoDataFrame:
     """
     Takes a GeoDataFrame as an input and appends a `country` column.
@@ -346,6 +1284,15 @@ def assign_to_ben_country(
     Centroids help to more deterministically assign a border-crossing patch to a country.
     For the small BEN patches (1200mx1200m) the _error_ of the approximation is negligible
     and a good heuristic to assign the patch to the country with the largest overlap.
+
+    Almost all centroids lie within a single country and are assigned with a fast
+    point-in-polygon query. Only the remaining centroids are assigned to the nearest country.
+    For BigEarthNet patches, the Sentinel tile of each patch is looked up first:
+    Patches of tiles that lie entirely within a single country are directly assigned
+    via a cached tile-to-country table, without any per-patch geometry operations.
+    If `simplify_tolerance` is given, the country borders are simplified with the
+    given tolerance (in units of `crs`) before the assignment.
+    This speeds up the assignment but may change the result for patches close to a border.
     """
     with Progress(
         TextColumn("{task.description}"),
@@ -359,19 +1306,28 @@ def assign_to_ben_country(
 
         # has column called NAME for country name
         task = progress.add_task("Loading country shapes", total=1)
-        borders = get_ben_countries_gdf()
-        borders = borders.to_crs(crs)
+        borders = get_ben_countries_gdf(crs)
+        if simplify_tolerance is not None:
+            borders.geometry = borders.geometry.simplify(simplify_tolerance)
         progress.update(task, completed=1)
 
         task = progress.add_task("Calculating centroids", total=1)
-        local_gdf.geometry = local_gdf.geometry.centroid
+        centroids = local_gdf.geometry.centroid
         progress.update(task, completed=1)
 
         task = progress.add_task("Assigning data to countries", total=1)
-        nn_gdf = local_gdf.sjoin_nearest(borders, how="inner")
+        names = _get_tile_countries(
+            _get_tile_ids(gdf),
+            centroids,
+            borders,
+            crs,
+            persist=simplify_tolerance is None,
+        )
+        missing = np.flatnonzero(pd.isna(names))
+        if len(missing) > 0:
+            names[missing] = _assign_points_to_borders(centroids.iloc[missing], borders)
+        gdf["country"] = names
         progress.update(task, completed=1)
-
-        gdf["country"] = nn_gdf["NAME"]
     return gdf
 
 
@@ -393,9 +1349,10 @@ class Season(str, enum.Enum):
         return self.value
 
 
-@validate_arguments
-def _month_to_season(month: conint(ge=1, le=12)) -> Season:
-    return Season.from_idx(month % 12 // 3)
+# index of the season for each month, where the index 0 is unused
+_MONTH_TO_SEASON_CODE = np.array(
+    [-1] + [m % 12 // 3 for m in range(1, 13)], dtype="int8"
+)
 
 
 def tfm_month_to_season(dates: pd.Series) -> pd.Series:
@@ -405,30 +1362,172 @@ def tfm_month_to_season(dates: pd.Series) -> pd.Series:
 
     The season is calculated as the meterological season, assuming
     that we are on the northern hemisphere.
+
+    The seasons are returned as a `Categorical` with the four `Season` values
+    as categories, which are looked up for all dates at once.
     """
-    return pd.to_datetime(dates).dt.month.apply(_month_to_season)
+    months = pd.to_datetime(dates).dt.month
+    if months.isna().any():
+        raise ValueError("All dates must be valid to calculate the season!")
+    codes = _MONTH_TO_SEASON_CODE[months.to_numpy(dtype=int)]
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories=[s.value for s in Season]),
+        index=dates.index,
+        name=dates.name,
+    )
 
 
 @validate_arguments
 def filter_season(df, date_col: str, season: Season) -> pd.DataFrame:
     seasons = tfm_month_to_season(df[date_col])
-    return df[seasons == season]
+    return df[seasons.cat.codes == list(Season).index(season)]
 
 
-def _add_full_ben_metadata(
-    gdf: geopandas.GeoDataFrame, s2_name_col: str, date_col: str
-) -> geopandas.GeoDataFrame:
+def _is_in_patch_sets(names: pd.Series, *patch_sets: Set[str]) -> np.ndarray:
+    "Vectorized check whether each of the `names` is part of any of the `patch_sets`."
+    return np.logical_or.reduce([names.isin(ps).to_numpy() for ps in patch_sets])
+
+
+def _get_snow_flags(names: pd.Series) -> np.ndarray:
+    "Vectorized version of `is_snowy_patch`."
+    return _is_in_patch_sets(
+        names,
+        get_s2_patches_with_seasonal_snow(),
+        get_s1_patches_with_seasonal_snow(),
+    )
+
+
+def _get_cloud_or_shadow_flags(names: pd.Series) -> np.ndarray:
+    "Vectorized version of `is_cloudy_shadowy_patch`."
+    return _is_in_patch_sets(
+        names,
+        get_s2_patches_with_cloud_and_shadow(),
+        get_s1_patches_with_cloud_and_shadow(),
+    )
+
+
+def _get_original_splits(names: pd.Series) -> np.ndarray:
     """
-    A function that adds all the entire BigEarthNet metadata.
+    Vectorized version of `get_original_split_from_patch_name`.
+    A single `UserWarning` is raised if any patch is not part of the original split.
+    """
+    splits = np.full(len(names), None, dtype=object)
+    # assign in reverse order to keep the precedence of the scalar version
+    for split, patch_sets in [
+        (
+            Split.test,
+            (
+                get_s1_patches_from_original_test_split(),
+                get_s2_patches_from_original_test_split(),
+            ),
+        ),
+        (
+            Split.validation,
+            (
+                get_s1_patches_from_original_validation_split(),
+                get_s2_patches_from_original_validation_split(),
+            ),
+        ),
+        (
+            Split.train,
+            (
+                get_s1_patches_from_original_train_split(),
+                get_s2_patches_from_original_train_split(),
+            ),
+        ),
+    ]:
+        splits[_is_in_patch_sets(names, *patch_sets)] = split
+    if pd.isna(splits).any():
+        warnings.warn(
+            "Provided input patch names which were not part of the original split.",
+            UserWarning,
+        )
+    return splits
+
+
+def _label_tuples(labels: pd.Series) -> List[tuple]:
+    "Convert the label lists/arrays into hashable tuples, where `None` is an empty tuple."
+    return [() if ls is None else tuple(ls) for ls in labels]
+
+
+def tfm_old2new_labels(labels: pd.Series) -> pd.Series:
+    """
+    Convert a series of old-style (43-class) label lists into the
+    new 19-class nomenclature, as done by `old2new_labels`.
+
+    The archive only contains a few thousand distinct label combinations,
+    so every unique combination is only converted once and the result
+    is broadcasted to all rows.
+    Each row gets its own list, so mutating one row does not affect the others.
+    """
+    codes, uniques = pd.factorize(pd.Series(_label_tuples(labels), dtype=object))
+    converted = [old2new_labels(list(unique_labels)) for unique_labels in uniques]
+    new_labels = np.empty(len(codes), dtype=object)
+    new_labels[:] = [
+        None if converted[c] is None else list(converted[c]) for c in codes
+    ]
+    return pd.Series(new_labels, index=labels.index, dtype=object)
+
+
+def labels_to_multi_hot(labels: pd.Series, label_names: List[str]) -> np.ndarray:
+    """
+    Encode each label list of `labels` as a `uint64` bit mask,
+    where the i-th bit is set if the i-th entry of `label_names` is present.
+    Missing label lists (`None`) are encoded as 0.
+    Use `OLD_LABELS` or `NEW_LABELS` from `bigearthnet_common.constants`
+    as `label_names`.
+
+    If an unknown label is given, a `KeyError` is raised.
+    """
+    if len(label_names) > 64:
+        raise ValueError("At most 64 labels can be encoded!")
+    bit_idx = {label: i for i, label in enumerate(label_names)}
+    codes, uniques = pd.factorize(pd.Series(_label_tuples(labels), dtype=object))
+    masks = np.array(
+        [sum(1 << bit_idx[label] for label in set(u)) for u in uniques],
+        dtype=np.uint64,
+    )
+    return masks[codes]
+
+
+def add_multi_hot_label_columns(
+    gdf: geopandas.GeoDataFrame,
+) -> geopandas.GeoDataFrame:
+    """
+    Add the integer multi-hot encoded columns `labels_multi_hot` (43-bit)
+    and `new_labels_multi_hot` (19-bit) next to the `labels` and
+    `new_labels` columns.
+    The bit order follows `OLD_LABELS` and `NEW_LABELS`
+    from `bigearthnet_common.constants`.
+    See `labels_to_multi_hot` for details.
+    """
+    gdf["labels_multi_hot"] = labels_to_multi_hot(gdf["labels"], OLD_LABELS)
+    if "new_labels" not in gdf.columns:
+        gdf["new_labels"] = tfm_old2new_labels(gdf["labels"])
+    gdf["new_labels_multi_hot"] = labels_to_multi_hot(gdf["new_labels"], NEW_LABELS)
+    return gdf
+
+
+def _add_full_ben_metadata(
+    gdf: geopandas.GeoDataFrame,
+    s2_name_col: str,
+    date_col: str,
+    multi_hot: bool = False,
+) -> geopandas.GeoDataFrame:
+    """
+    A function that adds all the entire BigEarthNet metadata.
     To be able to be used with S1 and S2 sources, the provided
     gdf needs to also get a series of `s2_names` to use the same
     logic for S1 that is used for S2 sources.
     Similarly, the `date_col` must be given.
+    If `multi_hot` is set, the multi-hot encoded label columns are added as well.
     """
-    gdf["new_labels"] = gdf["labels"].apply(old2new_labels)
-    gdf["snow"] = gdf[s2_name_col].apply(is_snowy_patch)
-    gdf["cloud_or_shadow"] = gdf[s2_name_col].apply(is_cloudy_shadowy_patch)
-    gdf["original_split"] = gdf[s2_name_col].apply(get_original_split_from_patch_name)
+    gdf["new_labels"] = tfm_old2new_labels(gdf["labels"])
+    if multi_hot:
+        gdf = add_multi_hot_label_columns(gdf)
+    gdf["snow"] = _get_snow_flags(gdf[s2_name_col])
+    gdf["cloud_or_shadow"] = _get_cloud_or_shadow_flags(gdf[s2_name_col])
+    gdf["original_split"] = _get_original_splits(gdf[s2_name_col])
     gdf = assign_to_ben_country(gdf)
     gdf["season"] = tfm_month_to_season(gdf[date_col])
     return gdf
@@ -439,7 +1538,9 @@ def _add_full_ben_metadata(
 # and by splitting the function, future updates
 # to the archives should be easier to incorporate.
 # There may be a future in which these two functions could be combined.
-def add_full_ben_s1_metadata(gdf: geopandas.GeoDataFrame) -> geopandas.GeoDataFrame:
+def add_full_ben_s1_metadata(
+    gdf: geopandas.GeoDataFrame, multi_hot: bool = False
+) -> geopandas.GeoDataFrame:
     """
     This is a wrapper around many functions from this library.
     It requires an input `GeoDataFrame` in *S1-BigEarthNet* style.
@@ -456,6 +1557,10 @@ def add_full_ben_s1_metadata(gdf: geopandas.GeoDataFrame) -> geopandas.GeoDataFr
     - `country`: `str` - The name of the BigEarthNet country the patch belongs to.
     - `season`: `str` - The season in which the tile was aquired.
 
+    If `multi_hot` is set, the `uint64` multi-hot encoded labels are added
+    as `labels_multi_hot` and `new_labels_multi_hot`.
+    See `add_multi_hot_label_columns` for details.
+
     In short, the function will add all the available metadata.
     """
     required_col_names = {
@@ -468,10 +1573,14 @@ def add_full_ben_s1_metadata(gdf: geopandas.GeoDataFrame) -> geopandas.GeoDataFr
     if len(diff) != 0:
         # note that possibly wrong date-column is shown in error message
         raise ValueError("The provided gdf is missing required columns: ", diff)
-    return _add_full_ben_metadata(gdf, "corresponding_s2_patch", "acquisition_time")
+    return _add_full_ben_metadata(
+        gdf, "corresponding_s2_patch", "acquisition_time", multi_hot=multi_hot
+    )
 
 
-def add_full_ben_s2_metadata(gdf: geopandas.GeoDataFrame) -> geopandas.GeoDataFrame:
+def add_full_ben_s2_metadata(
+    gdf: geopandas.GeoDataFrame, multi_hot: bool = False
+) -> geopandas.GeoDataFrame:
     """
     This is a wrapper around many functions from this library.
     It requires an input `GeoDataFrame` in *S2-BigEarthNet* style.
@@ -488,6 +1597,10 @@ def add_full_ben_s2_metadata(gdf: geopandas.GeoDataFrame) -> geopandas.GeoDataFr
     - `country`: `str` - The name of the BigEarthNet country the patch belongs to.
     - `season`: `str` - The season in which the tile was aquired.
 
+    If `multi_hot` is set, the `uint64` multi-hot encoded labels are added
+    as `labels_multi_hot` and `new_labels_multi_hot`.
+    See `add_multi_hot_label_columns` for details.
+
     In short, the function will add all the available metadata.
     """
     # allow both datetime formats!
@@ -496,12 +1609,60 @@ def add_full_ben_s2_metadata(gdf: geopandas.GeoDataFrame) -> geopandas.GeoDataFr
     if len(diff) != 0:
         # note that possibly wrong date-column is shown in error message
         raise ValueError("The provided gdf is missing required columns: ", diff)
-    return _add_full_ben_metadata(gdf, "name", "acquisition_date")
+    return _add_full_ben_metadata(gdf, "name", "acquisition_date", multi_hot=multi_hot)
+
+
+@functools.lru_cache()
+def _get_discouraged_patch_names() -> FrozenSet[str]:
+    """
+    Names of all S1 and S2 patches that are covered by seasonal snow or
+    clouds/shadows or that have no labels in the 19-class nomenclature.
+    """
+    return frozenset().union(
+        get_s2_patches_with_seasonal_snow(),
+        get_s2_patches_with_cloud_and_shadow(),
+        get_s2_patches_with_no_19_class_target(),
+        get_s1_patches_with_seasonal_snow(),
+        get_s1_patches_with_cloud_and_shadow(),
+        get_s1_patches_with_no_19_class_target(),
+    )
+
+
+def _is_recommended_patch_name(name: str) -> bool:
+    """
+    Check by the patch `name` alone whether the patch is recommended.
+    This allows to skip the discouraged patches of `remove_bad_ben_gdf_entries`
+    before their json files are read.
+    """
+    return name not in _get_discouraged_patch_names()
+
+
+def _passes_name_filters(
+    name: str, name_filters: Tuple[Callable[[str], bool], ...]
+) -> bool:
+    return all(name_filter(name) for name_filter in name_filters)
+
+
+def _combine_name_filters(
+    *name_filters: Optional[Callable[[str], bool]],
+) -> Optional[Callable[[str], bool]]:
+    "Combine the given patch-name filters, where `None` filters are ignored."
+    name_filters = tuple(f for f in name_filters if f is not None)
+    if len(name_filters) == 0:
+        return None
+    return functools.partial(_passes_name_filters, name_filters=name_filters)
 
 
 def _remove_snow_cloud_patches(gdf, s2_name_col):
-    snowy = gdf[s2_name_col].apply(is_snowy_patch)
-    cloudy = gdf[s2_name_col].apply(is_cloudy_shadowy_patch)
+    # reuse the flags if the metadata was already added
+    if "snow" in gdf.columns:
+        snowy = gdf["snow"].to_numpy(dtype=bool)
+    else:
+        snowy = _get_snow_flags(gdf[s2_name_col])
+    if "cloud_or_shadow" in gdf.columns:
+        cloudy = gdf["cloud_or_shadow"].to_numpy(dtype=bool)
+    else:
+        cloudy = _get_cloud_or_shadow_flags(gdf[s2_name_col])
     return gdf[~(snowy | cloudy)]
 
 
@@ -525,7 +1686,8 @@ def remove_bad_ben_gdf_entries(gdf: geopandas.GeoDataFrame) -> geopandas.GeoData
     s2_name_col = (
         "corresponding_s2_patch" if "corresponding_s2_patch" in gdf.columns else "name"
     )
-    gdf["new_labels"] = gdf["labels"].apply(old2new_labels)
+    if "new_labels" not in gdf.columns:
+        gdf["new_labels"] = tfm_old2new_labels(gdf["labels"])
     errs = gdf["new_labels"].isna()
     gdf.drop(gdf[errs].index, inplace=True)  # remove wrong elements
     gdf = _remove_snow_cloud_patches(gdf, s2_name_col)
@@ -533,12 +1695,911 @@ def remove_bad_ben_gdf_entries(gdf: geopandas.GeoDataFrame) -> geopandas.GeoData
     return gdf
 
 
+def to_compact_schema(gdf: geopandas.GeoDataFrame) -> geopandas.GeoDataFrame:
+    """
+    Convert the columns of a BigEarthNet-style `GeoDataFrame` into a compact schema.
+    The repeated string columns, such as `country`, `season`, `original_split`,
+    the tile/scene sources and the acquisition dates, are converted to
+    categoricals, which are stored as dictionary encoded columns in parquet.
+    The `snow` and `cloud_or_shadow` flags are converted to `bool`.
+
+    Only the present columns are converted.
+    The categoricals are restored by `geopandas.read_parquet`.
+    """
+    for col in _CATEGORICAL_COLS:
+        if col in gdf.columns and not isinstance(gdf[col].dtype, pd.CategoricalDtype):
+            # store the plain values of the `Season`/`Split` enums
+            gdf[col] = gdf[col].astype("category").cat.rename_categories(str)
+    for col in _BOOL_COLS:
+        if col in gdf.columns:
+            gdf[col] = gdf[col].astype(bool)
+    return gdf
+
+
+def _hilbert_distances(x: np.ndarray, y: np.ndarray, level: int) -> np.ndarray:
+    """
+    Vectorized distances of the integer grid cells `x`/`y` in `[0, 2**level)`
+    along the Hilbert curve of the given `level`.
+    """
+    x, y = np.array(x, dtype=np.int64), np.array(y, dtype=np.int64)
+    n = 1 << level
+    d = np.zeros(len(x), dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx.astype(np.int64)) ^ ry.astype(np.int64))
+        # rotate the quadrant to keep the curve continuous
+        flip = ~ry & rx
+        x[flip] = n - 1 - x[flip]
+        y[flip] = n - 1 - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap]
+        s >>= 1
+    return d
+
+
+def spatially_sort_gdf(
+    gdf: geopandas.GeoDataFrame, level: int = 16
+) -> geopandas.GeoDataFrame:
+    """
+    Sort the rows of `gdf` along the Hilbert curve of the patch centroids and
+    add the bounding box of each geometry as `xmin`, `ymin`, `xmax` and `ymax`
+    columns (in the projection of `gdf`).
+
+    Nearby patches end up in the same parquet row groups, so the min/max statistics
+    of the bbox columns allow readers to skip most row groups of a
+    region-of-interest query with predicate pushdown.
+    The centroids are mapped onto a `2**level x 2**level` grid over the total bounds.
+    """
+    bounds = gdf.geometry.bounds
+    cx = ((bounds["minx"] + bounds["maxx"]) / 2).to_numpy()
+    cy = ((bounds["miny"] + bounds["maxy"]) / 2).to_numpy()
+    n_cells = (1 << level) - 1
+    grid = []
+    for c in (cx, cy):
+        lo, hi = (c.min(), c.max()) if len(c) > 0 else (0.0, 0.0)
+        scale = n_cells / (hi - lo) if hi > lo else 0.0
+        grid.append(((c - lo) * scale).astype(np.int64))
+    order = np.argsort(_hilbert_distances(*grid, level=level), kind="stable")
+
+    gdf = gdf.assign(
+        **{
+            bbox_col: bounds[bound_col].to_numpy()
+            for bbox_col, bound_col in zip(_BBOX_COLS, ["minx", "miny", "maxx", "maxy"])
+        }
+    )
+    return gdf.iloc[order].reset_index(drop=True)
+
+
+def _hive_partition_dir(partition_cols: List[str], values: Tuple[Any, ...]) -> str:
+    """
+    Relative directory of the hive partition with the given `values`.
+    The values are URI-encoded and missing values are stored as the
+    hive default partition, as expected by `pyarrow.dataset`.
+    """
+    return "/".join(
+        f"{col}="
+        + (_HIVE_NULL_PARTITION if pd.isna(v) else urllib.parse.quote(str(v), safe=""))
+        for col, v in zip(partition_cols, values)
+    )
+
+
+def _check_partitioned_output_dir(output_dir: Path) -> None:
+    "Raise a `ValueError` if the partitioned `output_dir` is an existing file."
+    if Path(output_dir).is_file():
+        raise ValueError(
+            f"The partitioned output directory {output_dir} is an existing file, "
+            "for example the output of a previous non-partitioned build! "
+            "Choose a different output path."
+        )
+
+
+def write_partitioned_ben_parquet(
+    gdf: geopandas.GeoDataFrame,
+    output_dir: Path,
+    partition_cols: List[str] = _PARTITION_COLS,
+    n_writers: int = 8,
+    **kwargs,
+) -> Path:
+    """
+    Write `gdf` as a hive-partitioned dataset to `output_dir`, such as
+    `original_split=train/country=Austria/season=Summer/part-0.parquet`.
+    The partition columns are only encoded in the directory names and the
+    partitions are written concurrently by `n_writers` threads.
+    The other keyword arguments are passed to `GeoDataFrame.to_parquet`.
+
+    The partitions of a previous dataset in `output_dir` are replaced.
+    If `output_dir` is an existing file, a `ValueError` is raised.
+    Use `open_ben_dataset` or `query_ben_parquet` to read the partitions.
+
+    Returns the resolved output directory.
+    """
+    missing = set(partition_cols) - set(gdf.columns)
+    if len(missing) > 0:
+        raise ValueError("The gdf is missing the partition columns: ", missing)
+    output_dir = Path(output_dir).resolve()
+    _check_partitioned_output_dir(output_dir)
+    if output_dir.is_dir():
+        for stale_dir in output_dir.glob(f"{partition_cols[0]}=*"):
+            shutil.rmtree(stale_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    def write_partition(key, partition_gdf: geopandas.GeoDataFrame) -> None:
+        key = key if isinstance(key, tuple) else (key,)
+        partition_dir = output_dir / _hive_partition_dir(partition_cols, key)
+        partition_dir.mkdir(parents=True, exist_ok=True)
+        partition_gdf = partition_gdf.drop(columns=partition_cols)
+        partition_gdf.reset_index(drop=True).to_parquet(
+            partition_dir / "part-0.parquet", **kwargs
+        )
+
+    groups = gdf.groupby(partition_cols, sort=False, dropna=False, observed=True)
+    with ThreadPoolExecutor(n_writers) as executor:
+        # consume the results to propagate the errors
+        list(executor.map(lambda group: write_partition(*group), groups))
+    return output_dir
+
+
+def _write_ben_parquet(
+    gdf: geopandas.GeoDataFrame,
+    output_path: Path,
+    compact: bool = False,
+    spatial_sort: bool = False,
+    partitioned: bool = False,
+) -> None:
+    """
+    Write `gdf` to `output_path` with the optional compact schema of
+    `to_compact_schema` and the optional spatial order of `spatially_sort_gdf`.
+    The spatially sorted output is written in row groups of
+    `_SPATIAL_ROW_GROUP_SIZE` rows to provide fine-grained bbox statistics.
+    If `partitioned` is set, `output_path` is written as hive-partitioned directory
+    with `write_partitioned_ben_parquet`.
+    Otherwise, the patch-name index is updated with `_update_patch_name_index`.
+    """
+    if compact:
+        gdf = to_compact_schema(gdf)
+    kwargs = {}
+    if spatial_sort:
+        gdf = spatially_sort_gdf(gdf)
+        kwargs["row_group_size"] = _SPATIAL_ROW_GROUP_SIZE
+    if partitioned:
+        write_partitioned_ben_parquet(gdf, output_path, **kwargs)
+    else:
+        gdf.to_parquet(output_path, **kwargs)
+        _update_patch_name_index(output_path)
+
+
+def _name_index_path(ben_parquet_path: Path) -> Path:
+    "Path of the patch-name index that is stored next to the parquet file."
+    return Path(ben_parquet_path).with_suffix(".index.npy")
+
+
+def _build_patch_name_index(ben_parquet_path: Path) -> np.ndarray:
+    """
+    Build the structured array of the sorted fixed-width `name`s and their `row`s
+    of the parquet file at `ben_parquet_path`.
+    Only the `name` column is read from the parquet file.
+    If the names are not unique, a `ValueError` is raised.
+    """
+    names = pq.read_table(ben_parquet_path, columns=["name"]).column("name")
+    names = np.char.encode(np.asarray(names.to_pylist(), dtype=str), "ascii")
+    order = np.argsort(names, kind="stable")
+    index = np.empty(len(names), dtype=[("name", names.dtype), ("row", "<i8")])
+    index["name"] = names[order]
+    index["row"] = order
+    if (index["name"][1:] == index["name"][:-1]).any():
+        raise ValueError(f"The patch names of {ben_parquet_path} are not unique!")
+    return index
+
+
+def write_patch_name_index(ben_parquet_path: Path) -> Path:
+    """
+    Write the patch-name index of the parquet file at `ben_parquet_path` next to it.
+
+    The index is a `.npy` file with the sorted fixed-width names and their
+    row numbers in the parquet file, which can be memory-mapped and searched
+    with a binary search, see `PatchNameIndex`.
+    The file is replaced atomically, so concurrent readers never see
+    a partially written index.
+    If the names are not unique, a `ValueError` is raised.
+
+    Returns the path of the index.
+    """
+    index = _build_patch_name_index(ben_parquet_path)
+    index_path = _name_index_path(ben_parquet_path)
+    _replace_atomically(index_path, lambda path: np.save(path, index))
+    return index_path
+
+
+def _update_patch_name_index(ben_parquet_path: Path) -> None:
+    """
+    Write the patch-name index next to the freshly written parquet file.
+    As the index is optional, duplicated names only skip it with a warning
+    and remove the stale index of a previous build, instead of failing the build.
+    Outputs without a `name` column, such as queries of other columns,
+    silently skip the index.
+    """
+    if "name" not in pq.read_schema(ben_parquet_path).names:
+        _name_index_path(ben_parquet_path).unlink(missing_ok=True)
+        return
+    try:
+        write_patch_name_index(ben_parquet_path)
+    except ValueError as e:
+        _name_index_path(ben_parquet_path).unlink(missing_ok=True)
+        warnings.warn(f"{e} Skipping the patch-name index.", RuntimeWarning)
+
+
+class PatchNameIndex:
+    """
+    Read-only mapping from patch names to the row numbers of a parquet file,
+    backed by the memory-mapped index of `write_patch_name_index`.
+
+    The lookups are binary searches over the sorted fixed-width names,
+    and the index pages are shared by all processes, such as forked
+    data-loader workers, without copying the index.
+    Single names are looked up without any array conversions,
+    use `get_rows` to look up many names at once.
+    Instead of the `index_path`, an in-memory index array can be given as well.
+    """
+
+    def __init__(self, index_path: Union[Path, np.ndarray]):
+        if isinstance(index_path, np.ndarray):
+            self._index = index_path
+        else:
+            self._index = np.load(index_path, mmap_mode="r")
+        # plain array views of the memory map avoid the `np.memmap` overhead
+        self._names = np.asarray(self._index["name"])
+        self._rows = np.asarray(self._index["row"])
+        self._width = self._names.dtype.itemsize
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, name: str) -> bool:
+        return self._find_row(name) >= 0
+
+    def _find_row(self, name: str) -> int:
+        "Scalar variant of `get_rows`."
+        key = name.encode("utf-8")
+        # longer names would be truncated to a prefix by the fixed-width search
+        if len(key) > self._width:
+            return -1
+        position = self._names.searchsorted(key)
+        if position < len(self._names) and self._names[position] == key:
+            return int(self._rows[position])
+        return -1
+
+    def get_rows(self, names: Iterable[str]) -> np.ndarray:
+        "Vectorized lookup of the row numbers of `names`, where `-1` marks unknown names."
+        # non-ascii names are encoded to bytes that match none of the ascii names
+        keys = np.char.encode(np.asarray(list(names), dtype=str), "utf-8")
+        if len(self) == 0:
+            return np.full(len(keys), -1, dtype="<i8")
+        # longer names would be truncated to a prefix by the fixed-width cast
+        fits = np.char.str_len(keys) <= self._names.dtype.itemsize
+        positions = np.searchsorted(self._names, keys.astype(self._names.dtype))
+        positions = np.minimum(positions, len(self) - 1)
+        found = fits & (self._names[positions] == keys)
+        return np.where(found, self._rows[positions], -1)
+
+    def get_row(self, name: str) -> int:
+        "Row number of the patch `name`. Raises a `KeyError` for unknown names."
+        row = self._find_row(name)
+        if row < 0:
+            raise KeyError(name)
+        return row
+
+
+def get_patch_name_index(ben_parquet_path: Path) -> PatchNameIndex:
+    """
+    Open the patch-name index of the parquet file at `ben_parquet_path`.
+    The index is (re-)built with `write_patch_name_index` if it does not exist
+    or if it is older than the parquet file.
+    If the index cannot be written, for example in read-only or shared dataset
+    directories, an in-memory index is used instead.
+    """
+    index_path = _name_index_path(ben_parquet_path)
+    if (
+        not index_path.exists()
+        or index_path.stat().st_mtime_ns < Path(ben_parquet_path).stat().st_mtime_ns
+    ):
+        try:
+            write_patch_name_index(ben_parquet_path)
+        except OSError:
+            return PatchNameIndex(_build_patch_name_index(ben_parquet_path))
+    return PatchNameIndex(index_path)
+
+
+class BenMetadataLookup:
+    """
+    Look up the metadata of patches by their name in a BigEarthNet-style
+    parquet file, for example inside of a data loader.
+
+    The selected `columns` are loaded once as an arrow table and the rows
+    are found via the `PatchNameIndex` of the file.
+    The geometries are returned in the WKB format.
+    """
+
+    def __init__(self, ben_parquet_path: Path, columns: Optional[List[str]] = None):
+        self.index = get_patch_name_index(ben_parquet_path)
+        self.table = pq.read_table(ben_parquet_path, columns=columns, memory_map=True)
+        self._columns = list(zip(self.table.column_names, self.table.columns))
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def __getitem__(self, name: str) -> Dict[str, Any]:
+        "Metadata of the patch `name` as dictionary."
+        row = self.index.get_row(name)
+        return {col_name: col[row].as_py() for col_name, col in self._columns}
+
+    def get_rows(self, names: Iterable[str]) -> pd.DataFrame:
+        "Metadata of all `names` as `DataFrame` in the given order."
+        names = list(names)
+        rows = self.index.get_rows(names)
+        if (rows < 0).any():
+            raise KeyError([n for n, r in zip(names, rows) if r < 0])
+        return self.table.take(rows).to_pandas()
+
+
+def _manifest_path(output_path: Path) -> Path:
+    "Path of the manifest that is stored next to the raw parquet file."
+    return output_path.with_suffix(".manifest.parquet")
+
+
+def _write_manifest(manifest: pd.DataFrame, output_path: Path, sensor: str) -> None:
+    """
+    Write the `manifest` of the raw parquet file at `output_path`.
+    The `sensor` of the raw build is stored in the metadata of the manifest.
+    """
+    table = pa.Table.from_pandas(manifest, preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), b"sensor": sensor.encode("utf-8")}
+    pq.write_table(table.replace_schema_metadata(metadata), _manifest_path(output_path))
+
+
+def _read_manifest(output_path: Path) -> Tuple[pd.DataFrame, Optional[str]]:
+    """
+    Read the manifest of the raw parquet file at `output_path`.
+    Returns the manifest and its `sensor`, which is `None` for manifests
+    that were written without it.
+    """
+    table = pq.read_table(_manifest_path(output_path))
+    sensor = (table.schema.metadata or {}).get(b"sensor")
+    return table.to_pandas(), None if sensor is None else sensor.decode("utf-8")
+
+
+def _get_patch_manifest(patch_paths: List[Path]) -> pd.DataFrame:
+    """
+    Collect the modification time and size of the json file of each patch.
+    The `name` column is the name of the patch directory.
+    """
+    stats = [_json_path_from_patch_path(p).stat() for p in patch_paths]
+    return pd.DataFrame(
+        {
+            "name": [p.name for p in patch_paths],
+            "mtime_ns": [st.st_mtime_ns for st in stats],
+            "size": [st.st_size for st in stats],
+        }
+    )
+
+
+def _pop_manifest_columns(
+    gdf: geopandas.GeoDataFrame,
+) -> Tuple[geopandas.GeoDataFrame, pd.DataFrame]:
+    """
+    Split the json file statistics that were gathered by the workers
+    with `with_stats` off the `gdf`.
+    Returns the `gdf` without them and the corresponding manifest.
+    """
+    manifest = pd.DataFrame(
+        {
+            "name": gdf["name"].to_numpy(),
+            "mtime_ns": gdf["json_mtime_ns"].to_numpy(),
+            "size": gdf["json_size"].to_numpy(),
+        }
+    )
+    return gdf.drop(columns=["json_mtime_ns", "json_size"]), manifest
+
+
+def _iter_without_manifest_columns(
+    gdfs: Iterable[geopandas.GeoDataFrame], manifests: List[pd.DataFrame]
+) -> Iterator[geopandas.GeoDataFrame]:
+    "Lazy variant of `_pop_manifest_columns` that appends the manifests to `manifests`."
+    for gdf in gdfs:
+        gdf, manifest = _pop_manifest_columns(gdf)
+        manifests.append(manifest)
+        yield gdf
+
+
+def _widen_dictionary_indices(schema: pa.Schema) -> pa.Schema:
+    """
+    Use `int32` indices for all dictionary fields of `schema`.
+    The categorical columns of each chunk only use the smallest index type that fits
+    their own categories, which may be too narrow for the categories of later chunks.
+    """
+    for i, field in enumerate(schema):
+        if pa.types.is_dictionary(field.type):
+            value_type = pa.dictionary(
+                pa.int32(), field.type.value_type, field.type.ordered
+            )
+            schema = schema.set(i, field.with_type(value_type))
+    return schema
+
+
+def _write_gdf_chunks_to_parquet(
+    gdfs: Iterable[geopandas.GeoDataFrame], output_path: Path, row_group_size: int
+) -> int:
+    """
+    Write the `gdfs` into a single GeoParquet file at `output_path`
+    with a `pyarrow.parquet.ParquetWriter`.
+    Only the rows of the current row group with `row_group_size` rows
+    are buffered in memory.
+    The optional `bbox` entry of the geo metadata is omitted, as it would
+    only describe the first chunk.
+
+    Returns the number of written rows.
+    If no rows are written, an `ValueError` is raised.
+    """
+    writer = None
+    buffered: List[pa.Table] = []
+    n_buffered = n_written = 0
+    try:
+        for gdf in gdfs:
+            table = geopandas.io.arrow._geopandas_to_arrow(gdf, index=False)
+            if writer is None:
+                metadata = table.schema.metadata
+                geo = json.loads(metadata[b"geo"])
+                for col_meta in geo["columns"].values():
+                    col_meta.pop("bbox", None)
+                metadata[b"geo"] = json.dumps(geo).encode("utf-8")
+                schema = _widen_dictionary_indices(table.schema).with_metadata(metadata)
+                writer = pq.ParquetWriter(output_path, schema)
+            buffered.append(table.cast(schema))
+            n_buffered += len(table)
+            if n_buffered >= row_group_size:
+                table = pa.concat_tables(buffered)
+                n_full = n_buffered - n_buffered % row_group_size
+                writer.write_table(
+                    table.slice(0, n_full), row_group_size=row_group_size
+                )
+                buffered, n_buffered = [table.slice(n_full)], n_buffered - n_full
+                n_written += n_full
+        if writer is not None and n_buffered > 0:
+            writer.write_table(pa.concat_tables(buffered))
+            n_written += n_buffered
+    finally:
+        if writer is not None:
+            writer.close()
+    if n_written == 0:
+        raise ValueError("Empty gdf produced! Check provided directory!")
+    return n_written
+
+
+def _incremental_gdf_from_patch_paths(
+    patch_paths: List[Path],
+    manifest: pd.DataFrame,
+    output_path: Path,
+    gdf_builder: Callable[..., geopandas.GeoDataFrame],
+    target_proj: str,
+    sensor: str,
+    **kwargs,
+) -> geopandas.GeoDataFrame:
+    """
+    Update the existing parquet file at `output_path` with the current `patch_paths`.
+    Only the patches that are new or whose json file changed according to the
+    stored manifest are parsed with `gdf_builder`.
+    Entries of patches that no longer exist are dropped.
+    The rows follow the order of `patch_paths`.
+
+    Falls back to parsing all patches if no previous build/manifest exists,
+    if the previous build used a different `target_proj`, if its manifest belongs
+    to another `sensor` or if its columns differ from the ones of the freshly
+    parsed patches.
+    To verify the columns, at least one patch is always parsed again.
+    """
+    if not (output_path.exists() and _manifest_path(output_path).exists()):
+        return gdf_builder(patch_paths, target_proj=target_proj, **kwargs)
+    prev_manifest, prev_sensor = _read_manifest(output_path)
+    if prev_sensor != sensor or len(patch_paths) == 0:
+        return gdf_builder(patch_paths, target_proj=target_proj, **kwargs)
+    # the bbox columns of a spatially sorted build are recomputed on demand
+    prev_gdf = geopandas.read_parquet(output_path).drop(
+        columns=_BBOX_COLS, errors="ignore"
+    )
+    if prev_gdf.crs != pyproj.CRS.from_user_input(target_proj):
+        return gdf_builder(patch_paths, target_proj=target_proj, **kwargs)
+
+    merged = manifest.merge(
+        prev_manifest, on="name", how="left", suffixes=("", "_prev"), indicator=True
+    )
+    unchanged = (
+        (merged["_merge"] == "both")
+        & (merged["mtime_ns"] == merged["mtime_ns_prev"])
+        & (merged["size"] == merged["size_prev"])
+    ).to_numpy()
+    if unchanged.all():
+        # parse one patch again to compare the columns with the previous build
+        unchanged[0] = False
+    kept_gdf = prev_gdf[prev_gdf["name"].isin(manifest["name"][unchanged])]
+    changed_paths = [p for p, u in zip(patch_paths, unchanged) if not u]
+
+    changed_gdf = gdf_builder(changed_paths, target_proj=target_proj, **kwargs)
+    if set(changed_gdf.columns) != set(prev_gdf.columns):
+        return gdf_builder(patch_paths, target_proj=target_proj, **kwargs)
+    gdf = pd.concat([kept_gdf, changed_gdf], axis=0, ignore_index=True)
+    order = pd.Index(gdf["name"]).get_indexer(manifest["name"])
+    return gdf.iloc[order].reset_index(drop=True)
+
+
+def _get_patch_shard(name: str, num_shards: int) -> int:
+    """
+    Deterministically assign the patch `name` to one of `num_shards` shards.
+    A stable hash of the name is used, so the assignment is identical across
+    processes, machines and Python versions.
+    """
+    digest = hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % num_shards
+
+
+def _is_in_shard(name: str, shard_index: int, num_shards: int) -> bool:
+    return _get_patch_shard(name, num_shards) == shard_index
+
+
+def _get_shard_filter(
+    shard_index: Optional[int], num_shards: Optional[int]
+) -> Optional[Callable[[str], bool]]:
+    """
+    Return the patch-name filter of the shard `shard_index` out of `num_shards`
+    or `None` if no sharding is requested.
+    """
+    if shard_index is None and num_shards is None:
+        return None
+    if shard_index is None or num_shards is None:
+        raise ValueError("`shard_index` and `num_shards` must be set together!")
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(
+            f"`shard_index` must be in [0, {num_shards}), but is {shard_index}!"
+        )
+    return functools.partial(
+        _is_in_shard, shard_index=shard_index, num_shards=num_shards
+    )
+
+
+def _shard_output_path(
+    output_path: Path, shard_index: Optional[int], num_shards: Optional[int]
+) -> Path:
+    "Path of the part file of the shard `shard_index` that belongs to `output_path`."
+    if num_shards is None:
+        return output_path
+    return output_path.with_name(
+        f"{output_path.stem}.part-{shard_index:05d}-of-{num_shards:05d}"
+        f"{output_path.suffix}"
+    )
+
+
+def _find_shard_parts(output_path: Path) -> List[Path]:
+    """
+    Find the part files of the sharded build of `output_path`, ordered by shard index.
+    If the part files are incomplete or belong to different numbers of shards,
+    a `ValueError` is raised.
+    """
+    part_re = re.compile(
+        rf"{re.escape(output_path.stem)}\.part-(\d{{5}})-of-(\d{{5}})"
+        rf"{re.escape(output_path.suffix)}"
+    )
+    parts = {}
+    for path in output_path.parent.iterdir():
+        m = part_re.fullmatch(path.name)
+        if m is not None:
+            parts[(int(m.group(1)), int(m.group(2)))] = path
+    if len(parts) == 0:
+        raise ValueError(f"No part files of {output_path} found!")
+    num_shards = {n for _, n in parts}
+    if len(num_shards) > 1:
+        raise ValueError("Found part files of different numbers of shards!", num_shards)
+    num_shards = num_shards.pop()
+    missing = [i for i in range(num_shards) if (i, num_shards) not in parts]
+    if len(missing) > 0:
+        raise ValueError(f"Part files of the shards {missing} are missing!")
+    return [parts[(i, num_shards)] for i in range(num_shards)]
+
+
+def _check_part_schemas(part_paths: List[Path]) -> None:
+    """
+    Check that all part files share the same columns and types.
+    The index width of dictionary encoded (categorical) columns may differ.
+    If the schemas differ, a `ValueError` is raised.
+    """
+
+    def normalize(schema: pa.Schema) -> List[Tuple[str, pa.DataType]]:
+        return [
+            (f.name, f.type.value_type if pa.types.is_dictionary(f.type) else f.type)
+            for f in schema
+        ]
+
+    ref_schema = normalize(pq.read_schema(part_paths[0]))
+    for path in part_paths[1:]:
+        schema = normalize(pq.read_schema(path))
+        if schema != ref_schema:
+            raise ValueError(
+                f"Schema of {path} differs from {part_paths[0]}!",
+                set(schema) ^ set(ref_schema),
+            )
+
+
+def merge_raw_ben_parquet_parts(output_path: Path, verbose: bool = True) -> Path:
+    """
+    Merge the part files of a sharded raw build into the canonical parquet file
+    at `output_path`.
+    The part files are the outputs of the raw builders with `shard_index`/`num_shards`
+    for the same `output_path` and are expected in the same directory.
+
+    Before merging, it is checked that the part files of all shards exist and
+    that they share the same schema and projection.
+    The merged entries are sorted by `name`, so the output does not depend
+    on the number of shards or on the order in which they finished.
+    If all part files have a manifest, the merged manifest is written as well,
+    to allow future incremental builds.
+
+    Returns the resolved output path.
+    """
+    output_path = Path(output_path).resolve()
+    part_paths = _find_shard_parts(output_path)
+    _check_part_schemas(part_paths)
+    gdfs = [geopandas.read_parquet(p) for p in part_paths]
+    crs = {gdf.crs for gdf in gdfs}
+    if len(crs) > 1:
+        raise ValueError("The part files have different projections!", crs)
+    gdf = pd.concat(gdfs, axis=0, ignore_index=True)
+    if gdf["name"].duplicated().any():
+        raise ValueError("The part files contain duplicated patches!")
+    if any(isinstance(dtype, pd.CategoricalDtype) for dtype in gdfs[0].dtypes):
+        # the differing categories of the parts are unified by the compact schema
+        gdf = to_compact_schema(gdf)
+    gdf = gdf.sort_values("name", ignore_index=True)
+    gdf.to_parquet(output_path)
+    _update_patch_name_index(output_path)
+
+    if all(_manifest_path(p).exists() for p in part_paths):
+        manifests, sensors = zip(*(_read_manifest(p) for p in part_paths))
+        manifest = pd.concat(manifests).sort_values("name", ignore_index=True)
+        _write_manifest(manifest, output_path, sensors[0])
+    else:
+        _manifest_path(output_path).unlink(missing_ok=True)
+    if verbose:
+        rich.print(f"[green]Output written to:\n {output_path}[/green]")
+    return output_path
+
+
+def _build_raw_ben_parquet(
+    patch_paths: List[Path],
+    output_path: Path,
+    columns_builder: Callable[[List[Path]], Dict[str, list]],
+    n_workers: Optional[int],
+    target_proj: str,
+    verbose: bool,
+    incremental: bool,
+    row_group_size: Optional[int],
+    compact: bool,
+    sensor: str,
+    io_workers: Optional[int] = None,
+    name_filter: Optional[Callable[[str], bool]] = None,
+    spatial_sort: bool = False,
+) -> Path:
+    """
+    Shared logic of `build_raw_ben_s2_parquet` and `build_raw_ben_s1_parquet`.
+    The manifest of the parsed json files of the `sensor` is always written next
+    to the output, to allow future incremental builds.
+    Only `incremental` builds collect the manifest up front, otherwise the file
+    statistics are gathered by the workers while they read the json files.
+    If `name_filter` is given, only the patches whose name passes the filter are used.
+    """
+    if incremental and row_group_size is not None:
+        raise ValueError("`incremental` cannot be combined with `row_group_size`!")
+    if spatial_sort and row_group_size is not None:
+        raise ValueError("`spatial_sort` cannot be combined with `row_group_size`!")
+    if name_filter is not None:
+        patch_paths = [p for p in patch_paths if name_filter(p.name)]
+    output_path = output_path.resolve()
+    if incremental:
+        manifest = _get_patch_manifest(patch_paths)
+    else:
+        columns_builder = functools.partial(columns_builder, with_stats=True)
+    gdf_builder = functools.partial(
+        _parallel_gdf_path_builder,
+        columns_builder=columns_builder,
+        progress=verbose,
+        io_workers=io_workers,
+    )
+    if row_group_size is not None:
+        chunks = _iter_parallel_gdf_chunks(
+            patch_paths,
+            columns_builder,
+            n_workers=n_workers,
+            progress=verbose,
+            target_proj=target_proj,
+            io_workers=io_workers,
+            max_chunk_size=row_group_size,
+        )
+        manifests: List[pd.DataFrame] = []
+        chunks = _iter_without_manifest_columns(chunks, manifests)
+        if compact:
+            chunks = map(to_compact_schema, chunks)
+        _write_gdf_chunks_to_parquet(chunks, output_path, row_group_size)
+        _update_patch_name_index(output_path)
+        manifest = pd.concat(manifests, ignore_index=True)
+    else:
+        if incremental:
+            gdf = _incremental_gdf_from_patch_paths(
+                patch_paths,
+                manifest,
+                output_path,
+                gdf_builder,
+                n_workers=n_workers,
+                target_proj=target_proj,
+                sensor=sensor,
+            )
+        else:
+            gdf = gdf_builder(patch_paths, n_workers=n_workers, target_proj=target_proj)
+            gdf, manifest = _pop_manifest_columns(gdf)
+        if len(gdf) == 0:
+            raise ValueError("Empty gdf produced! Check provided directory!")
+        _write_ben_parquet(gdf, output_path, compact, spatial_sort)
+    _write_manifest(manifest, output_path, sensor)
+    if verbose:
+        rich.print(f"[green]Output written to:\n {output_path}[/green]")
+    return output_path
+
+
+def _column_chunks_to_gdf(
+    column_chunks: Iterable[Dict[str, list]], target_proj: str
+) -> geopandas.GeoDataFrame:
+    """
+    Build a single `GeoDataFrame` from the column chunks of a tar archive.
+    If the archive contains no patches, an `ValueError` is raised.
+    """
+    column_chunks = list(column_chunks)
+    if len(column_chunks) == 0:
+        raise ValueError("Empty gdf produced! Check provided archive!")
+    return _columns_to_gdf(_concat_column_chunks(column_chunks), target_proj)
+
+
+def _build_raw_ben_parquet_from_tar(
+    tar_path: Path,
+    output_path: Path,
+    pattern: re.Pattern,
+    expected_keys: Set[str],
+    records_to_columns: Callable[[List[Dict[str, Any]]], Dict[str, list]],
+    target_proj: str,
+    verbose: bool,
+    incremental: bool,
+    row_group_size: Optional[int],
+    compact: bool,
+    name_filter: Optional[Callable[[str], bool]] = None,
+    spatial_sort: bool = False,
+) -> Path:
+    """
+    Tar archive variant of `_build_raw_ben_parquet`.
+    The archive is read once sequentially and only the json metadata files are parsed.
+    As the archive members have no stable file statistics,
+    no manifest is written and a stale manifest of a previous build is removed.
+    """
+    if incremental:
+        raise ValueError("`incremental` is not supported for tar archives!")
+    if spatial_sort and row_group_size is not None:
+        raise ValueError("`spatial_sort` cannot be combined with `row_group_size`!")
+    output_path = output_path.resolve()
+    chunk_size = 1024 if row_group_size is None else min(1024, row_group_size)
+    column_chunks = _iter_tar_column_chunks(
+        tar_path,
+        pattern,
+        expected_keys,
+        records_to_columns,
+        chunk_size=chunk_size,
+        name_filter=name_filter,
+    )
+    if row_group_size is not None:
+        chunks = (
+            _columns_to_gdf(_concat_column_chunks([c]), target_proj)
+            for c in column_chunks
+        )
+        if compact:
+            chunks = map(to_compact_schema, chunks)
+        _write_gdf_chunks_to_parquet(chunks, output_path, row_group_size)
+        _update_patch_name_index(output_path)
+    else:
+        gdf = _column_chunks_to_gdf(column_chunks, target_proj)
+        _write_ben_parquet(gdf, output_path, compact, spatial_sort)
+    _manifest_path(output_path).unlink(missing_ok=True)
+    if verbose:
+        rich.print(f"[green]Output written to:\n {output_path}[/green]")
+    return output_path
+
+
+def _get_raw_ben_s2_gdf(
+    ben_path: Path,
+    n_workers: Optional[int] = None,
+    target_proj: str = "epsg:3035",
+    verbose: bool = True,
+    io_workers: Optional[int] = None,
+    name_filter: Optional[Callable[[str], bool]] = None,
+) -> geopandas.GeoDataFrame:
+    """
+    In-memory variant of `build_raw_ben_s2_parquet` for a folder or tar archive.
+    If `name_filter` is given, only the patches whose name passes the filter are parsed.
+    """
+    if _is_tar_archive(ben_path):
+        column_chunks = _iter_tar_column_chunks(
+            Path(ben_path),
+            BEN_S2_RE,
+            BEN_S2_V1_0_JSON_KEYS,
+            _ben_s2_records_to_columns,
+            name_filter=name_filter,
+        )
+        return _column_chunks_to_gdf(column_chunks, target_proj)
+    patch_paths = discover_s2_patch_directories(ben_path)
+    if name_filter is not None:
+        patch_paths = [p for p in patch_paths if name_filter(p.name)]
+    return build_gdf_from_s2_patch_paths(
+        patch_paths,
+        n_workers=n_workers,
+        progress=verbose,
+        target_proj=target_proj,
+        io_workers=io_workers,
+    )
+
+
+def _get_raw_ben_s1_gdf(
+    ben_path: Path,
+    n_workers: Optional[int] = None,
+    target_proj: str = "epsg:3035",
+    verbose: bool = True,
+    io_workers: Optional[int] = None,
+    name_filter: Optional[Callable[[str], bool]] = None,
+) -> geopandas.GeoDataFrame:
+    """
+    In-memory variant of `build_raw_ben_s1_parquet` for a folder or tar archive.
+    If `name_filter` is given, only the patches whose name passes the filter are parsed.
+    """
+    if _is_tar_archive(ben_path):
+        column_chunks = _iter_tar_column_chunks(
+            Path(ben_path),
+            BEN_S1_RE,
+            BEN_S1_V1_0_JSON_KEYS,
+            _ben_s1_records_to_columns,
+            name_filter=name_filter,
+        )
+        return _column_chunks_to_gdf(column_chunks, target_proj)
+    patch_paths = discover_s1_patch_directories(ben_path)
+    if name_filter is not None:
+        patch_paths = [p for p in patch_paths if name_filter(p.name)]
+    return build_gdf_from_s1_patch_paths(
+        patch_paths,
+        n_workers=n_workers,
+        progress=verbose,
+        target_proj=target_proj,
+        io_workers=io_workers,
+    )
+
+
 def build_raw_ben_s2_parquet(
     ben_path: Path,
     output_path: Path = Path() / "raw_ben_s2_gdf.parquet",
-    n_workers: int = 8,
+    n_workers: Optional[int] = None,
     target_proj: str = "epsg:3035",
     verbose: bool = True,
+    incremental: bool = False,
+    row_group_size: Optional[int] = None,
+    compact: bool = False,
+    io_workers: Optional[int] = None,
+    shard_index: Optional[int] = None,
+    num_shards: Optional[int] = None,
+    skip_discouraged: bool = False,
+    spatial_sort: bool = False,
 ) -> Path:
     """
     Create a fresh BigEarthNet-S2-style parquet file
@@ -547,25 +2608,101 @@ def build_raw_ben_s2_parquet(
 
     The default output is `raw_ben_s2_gdf` in the current directory.
 
+    If `incremental` is set and `output_path` was previously built by this function,
+    only new or modified patches are parsed and removed patches are dropped.
+    Changes are detected via the manifest of the json modification times and sizes
+    that is stored next to the output.
+
+    If `row_group_size` is given, the parsed chunks are streamed into the output
+    with row groups of `row_group_size` rows, instead of assembling the entire
+    GeoDataFrame in memory first.
+    The peak memory usage is then bounded by the `row_group_size` and not
+    by the size of the dataset.
+
+    If `compact` is set, the output is stored with the compact schema
+    of `to_compact_schema`.
+
+    `ben_path` may also point to the (compressed) tar archive of the dataset.
+    The archive is then streamed once and only the json metadata files are parsed,
+    without extracting the archive to disk.
+
+    On high-latency file systems, such as NFS or Lustre, set `io_workers`
+    to the number of json files that should be read concurrently (e.g. 256).
+    The reads are then issued by threads and only the parsing is distributed over
+    the `n_workers` processes, which can then be kept small.
+
+    If `n_workers` is not set, the number of processes and the number of patches
+    per process call are auto-tuned for the current machine and the chosen settings
+    are reported.
+
+    To distribute the build over several machines or jobs, set `num_shards` and
+    a different `shard_index` for each job.
+    The patches are partitioned deterministically by their hashed name and each
+    shard writes its own part file next to `output_path`.
+    The part files are combined with `merge_raw_ben_parquet_parts`.
+
+    If `skip_discouraged` is set, the patches that are known to be covered by
+    seasonal snow or clouds/shadows or to have no labels in the 19-class nomenclature
+    are skipped by their name alone, without reading their json files.
+    See `remove_bad_ben_gdf_entries` for details.
+
+    If `spatial_sort` is set, the output is sorted along a Hilbert curve and
+    the bbox columns are added, see `spatially_sort_gdf`.
+
     The other options are only for advanced use.
     Returns the resolved output path.
     """
-    output_path = output_path.resolve()
-    gdf = get_gdf_from_s2_patch_dir(
-        ben_path, n_workers=n_workers, target_proj=target_proj
+    name_filter = _combine_name_filters(
+        _get_shard_filter(shard_index, num_shards),
+        _is_recommended_patch_name if skip_discouraged else None,
+    )
+    output_path = _shard_output_path(Path(output_path), shard_index, num_shards)
+    if _is_tar_archive(ben_path):
+        return _build_raw_ben_parquet_from_tar(
+            Path(ben_path),
+            output_path,
+            BEN_S2_RE,
+            BEN_S2_V1_0_JSON_KEYS,
+            _ben_s2_records_to_columns,
+            target_proj=target_proj,
+            verbose=verbose,
+            incremental=incremental,
+            row_group_size=row_group_size,
+            compact=compact,
+            name_filter=name_filter,
+            spatial_sort=spatial_sort,
+        )
+    return _build_raw_ben_parquet(
+        discover_s2_patch_directories(ben_path),
+        output_path,
+        _ben_s2_patches_to_columns,
+        n_workers=n_workers,
+        target_proj=target_proj,
+        verbose=verbose,
+        incremental=incremental,
+        row_group_size=row_group_size,
+        compact=compact,
+        sensor="s2",
+        io_workers=io_workers,
+        name_filter=name_filter,
+        spatial_sort=spatial_sort,
     )
-    gdf.to_parquet(output_path)
-    if verbose:
-        rich.print(f"[green]Output written to:\n {output_path}[/green]")
-    return output_path
 
 
 def build_raw_ben_s1_parquet(
     ben_path: Path,
     output_path: Path = Path() / "raw_ben_s1_gdf.parquet",
-    n_workers: int = 8,
+    n_workers: Optional[int] = None,
     target_proj: str = "epsg:3035",
     verbose: bool = True,
+    incremental: bool = False,
+    row_group_size: Optional[int] = None,
+    compact: bool = False,
+    io_workers: Optional[int] = None,
+    shard_index: Optional[int] = None,
+    num_shards: Optional[int] = None,
+    skip_discouraged: bool = False,
+    spatial_sort: bool = False,
 ) -> Path:
     """
     Create a fresh BigEarthNet-S1-style parquet file
@@ -574,23 +2711,94 @@ def build_raw_ben_s1_parquet(
 
     The default output is `raw_ben_s1_gdf` in the current directory.
 
+    If `incremental` is set and `output_path` was previously built by this function,
+    only new or modified patches are parsed and removed patches are dropped.
+    Changes are detected via the manifest of the json modification times and sizes
+    that is stored next to the output.
+
+    If `row_group_size` is given, the parsed chunks are streamed into the output
+    with row groups of `row_group_size` rows, instead of assembling the entire
+    GeoDataFrame in memory first.
+    The peak memory usage is then bounded by the `row_group_size` and not
+    by the size of the dataset.
+
+    If `compact` is set, the output is stored with the compact schema
+    of `to_compact_schema`.
+
+    `ben_path` may also point to the (compressed) tar archive of the dataset.
+    The archive is then streamed once and only the json metadata files are parsed,
+    without extracting the archive to disk.
+
+    On high-latency file systems, such as NFS or Lustre, set `io_workers`
+    to the number of json files that should be read concurrently (e.g. 256).
+    The reads are then issued by threads and only the parsing is distributed over
+    the `n_workers` processes, which can then be kept small.
+
+    If `n_workers` is not set, the number of processes and the number of patches
+    per process call are auto-tuned for the current machine and the chosen settings
+    are reported.
+
+    To distribute the build over several machines or jobs, set `num_shards` and
+    a different `shard_index` for each job.
+    The patches are partitioned deterministically by their hashed name and each
+    shard writes its own part file next to `output_path`.
+    The part files are combined with `merge_raw_ben_parquet_parts`.
+
+    If `skip_discouraged` is set, the patches that are known to be covered by
+    seasonal snow or clouds/shadows or to have no labels in the 19-class nomenclature
+    are skipped by their name alone, without reading their json files.
+    See `remove_bad_ben_gdf_entries` for details.
+
+    If `spatial_sort` is set, the output is sorted along a Hilbert curve and
+    the bbox columns are added, see `spatially_sort_gdf`.
+
     The other options are only for advanced use.
     Returns the resolved output path.
     """
-    output_path = output_path.resolve()
-    gdf = get_gdf_from_s1_patch_dir(
-        ben_path, n_workers=n_workers, target_proj=target_proj
+    name_filter = _combine_name_filters(
+        _get_shard_filter(shard_index, num_shards),
+        _is_recommended_patch_name if skip_discouraged else None,
+    )
+    output_path = _shard_output_path(Path(output_path), shard_index, num_shards)
+    if _is_tar_archive(ben_path):
+        return _build_raw_ben_parquet_from_tar(
+            Path(ben_path),
+            output_path,
+            BEN_S1_RE,
+            BEN_S1_V1_0_JSON_KEYS,
+            _ben_s1_records_to_columns,
+            target_proj=target_proj,
+            verbose=verbose,
+            incremental=incremental,
+            row_group_size=row_group_size,
+            compact=compact,
+            name_filter=name_filter,
+            spatial_sort=spatial_sort,
+        )
+    return _build_raw_ben_parquet(
+        discover_s1_patch_directories(ben_path),
+        output_path,
+        _ben_s1_patches_to_columns,
+        n_workers=n_workers,
+        target_proj=target_proj,
+        verbose=verbose,
+        incremental=incremental,
+        row_group_size=row_group_size,
+        compact=compact,
+        sensor="s1",
+        io_workers=io_workers,
+        name_filter=name_filter,
+        spatial_sort=spatial_sort,
     )
-    gdf.to_parquet(output_path)
-    if verbose:
-        rich.print(f"[green]Output written to:\n {output_path}[/green]")
-    return output_path
 
 
 def extend_ben_s2_parquet(
     ben_parquet_path: Path,
     output_name: str = "extended_ben_s2_gdf.parquet",
     verbose: bool = True,
+    multi_hot: bool = False,
+    compact: bool = False,
+    spatial_sort: bool = False,
 ) -> Path:
     """
     Extend an existing BigEarthNet-S2-style parquet file.
@@ -598,6 +2806,11 @@ def extend_ben_s2_parquet(
     The output will be written next to `ben_parquet_path` with the file
     `output_name`.
     The default name is `extended_ben_s2_gdf`.
+    If `multi_hot` is set, the multi-hot encoded label columns are added as well.
+    If `compact` is set, the output is stored with the compact schema
+    of `to_compact_schema`.
+    If `spatial_sort` is set, the output is sorted along a Hilbert curve and
+    the bbox columns are added, see `spatially_sort_gdf`.
 
     This function heavily relies on the structure of the parquet file.
     It should only be used on parquet files that were build with this library!
@@ -605,9 +2818,9 @@ def extend_ben_s2_parquet(
     """
     path = ben_parquet_path.resolve(strict=True)
     gdf = geopandas.read_parquet(path)
-    extended_gdf = add_full_ben_s2_metadata(gdf)
+    extended_gdf = add_full_ben_s2_metadata(gdf, multi_hot=multi_hot)
     output_path = path.with_name(output_name)
-    extended_gdf.to_parquet(output_path)
+    _write_ben_parquet(extended_gdf, output_path, compact, spatial_sort)
     if verbose:
         rich.print(f"[green]Output written to:\n {output_path}[/green]")
     return output_path
@@ -617,6 +2830,9 @@ def extend_ben_s1_parquet(
     ben_parquet_path: Path,
     output_name: str = "extended_ben_s1_gdf.parquet",
     verbose: bool = True,
+    multi_hot: bool = False,
+    compact: bool = False,
+    spatial_sort: bool = False,
 ) -> Path:
     """
     Extend an existing BigEarthNet-S1-style parquet file.
@@ -624,6 +2840,11 @@ def extend_ben_s1_parquet(
     The output will be written next to `ben_parquet_path` with the file
     `output_name`.
     The default name is `extended_ben_s1_gdf`.
+    If `multi_hot` is set, the multi-hot encoded label columns are added as well.
+    If `compact` is set, the output is stored with the compact schema
+    of `to_compact_schema`.
+    If `spatial_sort` is set, the output is sorted along a Hilbert curve and
+    the bbox columns are added, see `spatially_sort_gdf`.
 
     This function heavily relies on the structure of the parquet file.
     It should only be used on parquet files that were build with this library!
@@ -631,9 +2852,9 @@ def extend_ben_s1_parquet(
     """
     path = ben_parquet_path.resolve(strict=True)
     gdf = geopandas.read_parquet(path)
-    extended_gdf = add_full_ben_s1_metadata(gdf)
+    extended_gdf = add_full_ben_s1_metadata(gdf, multi_hot=multi_hot)
     output_path = path.with_name(output_name)
-    extended_gdf.to_parquet(output_path)
+    _write_ben_parquet(extended_gdf, output_path, compact, spatial_sort)
     if verbose:
         rich.print(f"[green]Output written to:\n {output_path}[/green]")
     return output_path
@@ -643,6 +2864,7 @@ def remove_discouraged_parquet_entries(
     ben_parquet_path: Path,
     output_name: str = "cleaned_ben_gdf.parquet",
     verbose: bool = True,
+    compact: bool = False,
 ) -> Path:
     """
     Remove entries of an existing BigEarthNet-style (S1 or S2) parquet file.
@@ -653,108 +2875,473 @@ def remove_discouraged_parquet_entries(
 
     This function only requires the input parquet file to have the
     `name` column and the original 43-class nomenclature called `labels`.
+    If `compact` is set, the output is stored with the compact schema
+    of `to_compact_schema`.
     """
     path = ben_parquet_path.resolve(strict=True)
     gdf = geopandas.read_parquet(path)
     cleaned_gdf = remove_bad_ben_gdf_entries(gdf)
     output_path = path.with_name(output_name)
-    cleaned_gdf.to_parquet(output_path)
+    _write_ben_parquet(cleaned_gdf, output_path, compact)
     if verbose:
         rich.print(f"[green]Output written to:\n {output_path}[/green]")
     return output_path
 
 
-@fc.delegates(build_raw_ben_s2_parquet, but=["output_path"])
+def _build_recommended_ben_parquet(
+    ben_path: Path,
+    output_path: Path,
+    add_metadata: bool,
+    compact: bool,
+    checkpoint_dir: Optional[Path],
+    spatial_sort: bool,
+    partitioned: bool,
+    multi_hot: bool,
+    raw_builder: Callable[..., Path],
+    raw_gdf_builder: Callable[..., geopandas.GeoDataFrame],
+    metadata_adder: Callable[..., geopandas.GeoDataFrame],
+    raw_name: str,
+    extended_name: str,
+    incremental: bool = False,
+    row_group_size: Optional[int] = None,
+    **kwargs,
+) -> Path:
+    """
+    Shared logic of `build_recommended_s2_parquet` and `build_recommended_s1_parquet`.
+    The discouraged patches are filtered by their names before their json files
+    are parsed.
+    The raw GeoDataFrame is only written to and read back from disk if it is
+    checkpointed or if the `incremental`/`row_group_size` options of the raw
+    builder require a raw parquet file.
+    Those raw builds are kept as `raw_name` in the `checkpoint_dir` or in the `USER_DIR`.
+    """
+    if partitioned and not add_metadata:
+        raise ValueError("The partitioned output requires `add_metadata`!")
+    output_path = Path(output_path).resolve()
+    if partitioned:
+        # fail before parsing the archive
+        _check_partitioned_output_dir(output_path)
+    if checkpoint_dir is not None:
+        checkpoint_dir = Path(checkpoint_dir).resolve()
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        rich.print("[yellow]The intermediate results will be stored in: [/yellow]")
+        rich.print(f"[yellow]{checkpoint_dir}[/yellow]\n\n")
+
+    rich.print("Parsing from json files")
+    rich.print("This may take up to 30min for the entire dataset!")
+    if checkpoint_dir is None and not incremental and row_group_size is None:
+        gdf = raw_gdf_builder(
+            ben_path, name_filter=_is_recommended_patch_name, **kwargs
+        )
+    else:
+        raw_gdf_path = raw_builder(
+            ben_path,
+            output_path=Path(checkpoint_dir or USER_DIR) / raw_name,
+            incremental=incremental,
+            row_group_size=row_group_size,
+            compact=compact,
+            skip_discouraged=True,
+            **kwargs,
+        )
+        gdf = geopandas.read_parquet(raw_gdf_path)
+
+    # the discouraged patches are already skipped by their names,
+    # but the labels are verified after parsing
+    rich.print("Removing discouraged entries")
+    gdf = remove_bad_ben_gdf_entries(gdf)
+    if checkpoint_dir is not None:
+        _write_ben_parquet(gdf, checkpoint_dir / "cleaned_ben_gdf.parquet")
+
+    if add_metadata:
+        rich.print("Adding metadata")
+        gdf = metadata_adder(gdf, multi_hot=multi_hot)
+        if checkpoint_dir is not None:
+            _write_ben_parquet(gdf, checkpoint_dir / extended_name)
+    elif multi_hot:
+        gdf = add_multi_hot_label_columns(gdf)
+
+    _write_ben_parquet(gdf, output_path, compact, spatial_sort, partitioned)
+    rich.print(f"Final result written to {output_path}")
+    return output_path
+
+
+@fc.delegates(
+    build_raw_ben_s2_parquet,
+    but=["output_path", "shard_index", "num_shards", "skip_discouraged"],
+)
 def build_recommended_s2_parquet(
     ben_path: Path,
     add_metadata: bool = True,
     output_path: Path = "final_ben_s2.parquet",
+    compact: bool = False,
+    checkpoint_dir: Optional[Path] = None,
+    spatial_sort: bool = False,
+    partitioned: bool = False,
+    multi_hot: bool = False,
     **kwargs,
 ) -> Path:
     """
     Generate the recommended S2-GeoDataFrame and save
     it as a parquet file.
 
-    It will call `build_raw_ben_s2_parquet` under the hood and remove
+    It will parse the patches as `build_raw_ben_s2_parquet` and remove
     patches that are not recommended for DL.
+    The discouraged patches are skipped by their names before parsing.
     If `add_metadata` is set, the GeoDataFrame will be
     enriched with extra information, such as Country and Season of the patch.
     See `add_full_ben_metadata` for more information.
 
-    This tool will store all intermediate results in a temporary directory.
-    This temporary directory will be printed to allow accessing these
-    intermediate results if necessary.
-    The resulting GeoDataFrame will be copied to `output_path`.
+    All steps run in memory and only the final GeoDataFrame is written to `output_path`.
+    If `checkpoint_dir` is given, the intermediate results of each step are stored
+    in this directory as well, to allow accessing these intermediate results.
+    If `compact` is set, the output is stored with the compact schema
+    of `to_compact_schema`.
+    If `spatial_sort` is set, the output is sorted along a Hilbert curve and
+    the bbox columns are added, see `spatially_sort_gdf`.
+    If `partitioned` is set, `output_path` is written as directory that is
+    hive-partitioned by `original_split`, `country` and `season`.
+    This requires `add_metadata`. See `write_partitioned_ben_parquet` for details.
+    If `multi_hot` is set, the multi-hot encoded label columns are added as well,
+    see `add_multi_hot_label_columns`.
 
     The other keyword arguments should usually be left untouched.
     """
-    output_path = Path(output_path).resolve()
-    intermediate_dir = Path(USER_DIR)
-    rich.print("[yellow]The intermediate results will be stored in: [/yellow]")
-    rich.print(f"[yellow]{intermediate_dir}[/yellow]\n\n")
-
-    rich.print("Parsing from json files")
-    rich.print("This may take up to 30min for the entire dataset!")
-    raw_gdf_path = build_raw_ben_s2_parquet(
-        ben_path, output_path=intermediate_dir / "raw_ben_gdf.parquet", **kwargs
+    return _build_recommended_ben_parquet(
+        ben_path,
+        output_path,
+        add_metadata=add_metadata,
+        compact=compact,
+        checkpoint_dir=checkpoint_dir,
+        spatial_sort=spatial_sort,
+        partitioned=partitioned,
+        multi_hot=multi_hot,
+        raw_builder=build_raw_ben_s2_parquet,
+        raw_gdf_builder=_get_raw_ben_s2_gdf,
+        metadata_adder=add_full_ben_s2_metadata,
+        raw_name="raw_ben_s2_gdf.parquet",
+        extended_name="extended_ben_s2_gdf.parquet",
+        **kwargs,
     )
 
-    rich.print("Removing discouraged entries")
-    gdf_path = remove_discouraged_parquet_entries(raw_gdf_path)
 
-    if add_metadata:
-        rich.print("Adding metadata")
-        gdf_path = extend_ben_s2_parquet(gdf_path)
-
-    shutil.copyfile(gdf_path, output_path)
-    rich.print(f"Final result copied to {output_path}")
-    return output_path
-
-
-@fc.delegates(build_raw_ben_s1_parquet, but=["output_path"])
+@fc.delegates(
+    build_raw_ben_s1_parquet,
+    but=["output_path", "shard_index", "num_shards", "skip_discouraged"],
+)
 def build_recommended_s1_parquet(
     ben_path: Path,
     add_metadata: bool = True,
     output_path: Path = "final_ben_s1.parquet",
+    compact: bool = False,
+    checkpoint_dir: Optional[Path] = None,
+    spatial_sort: bool = False,
+    partitioned: bool = False,
+    multi_hot: bool = False,
     **kwargs,
 ) -> Path:
     """
     Generate the recommended S1-GeoDataFrame and save
     it as a parquet file.
 
-    It will call `build_raw_ben_s1_parquet` under the hood and remove
+    It will parse the patches as `build_raw_ben_s1_parquet` and remove
     patches that are not recommended for DL.
+    The discouraged patches are skipped by their names before parsing.
     If `add_metadata` is set, the GeoDataFrame will be
     enriched with extra information, such as Country and Season of the patch.
     See `add_full_ben_metadata` for more information.
 
-    This tool will store all intermediate results in the default USER directory.
-    This directory will be printed to allow accessing these
-    intermediate results if necessary.
-    The resulting GeoDataFrame will be copied to `output_path`.
+    All steps run in memory and only the final GeoDataFrame is written to `output_path`.
+    If `checkpoint_dir` is given, the intermediate results of each step are stored
+    in this directory as well, to allow accessing these intermediate results.
+    If `compact` is set, the output is stored with the compact schema
+    of `to_compact_schema`.
+    If `spatial_sort` is set, the output is sorted along a Hilbert curve and
+    the bbox columns are added, see `spatially_sort_gdf`.
+    If `partitioned` is set, `output_path` is written as directory that is
+    hive-partitioned by `original_split`, `country` and `season`.
+    This requires `add_metadata`. See `write_partitioned_ben_parquet` for details.
+    If `multi_hot` is set, the multi-hot encoded label columns are added as well,
+    see `add_multi_hot_label_columns`.
 
     The other keyword arguments should usually be left untouched.
     """
-    output_path = Path(output_path).resolve()
-    intermediate_dir = Path(USER_DIR)
-    rich.print("[yellow]The intermediate results will be stored in: [/yellow]")
-    rich.print(f"[yellow]{intermediate_dir}[/yellow]\n\n")
+    return _build_recommended_ben_parquet(
+        ben_path,
+        output_path,
+        add_metadata=add_metadata,
+        compact=compact,
+        checkpoint_dir=checkpoint_dir,
+        spatial_sort=spatial_sort,
+        partitioned=partitioned,
+        multi_hot=multi_hot,
+        raw_builder=build_raw_ben_s1_parquet,
+        raw_gdf_builder=_get_raw_ben_s1_gdf,
+        metadata_adder=add_full_ben_s1_metadata,
+        raw_name="raw_ben_s1_gdf.parquet",
+        extended_name="extended_ben_s1_gdf.parquet",
+        **kwargs,
+    )
 
-    rich.print("Parsing from json files")
-    rich.print("This may take up to 30min for the entire dataset!")
-    raw_gdf_path = build_raw_ben_s1_parquet(
-        ben_path, output_path=intermediate_dir / "raw_ben_gdf.parquet", **kwargs
+
+def pair_ben_gdfs(
+    s2_gdf: geopandas.GeoDataFrame, s1_gdf: geopandas.GeoDataFrame
+) -> geopandas.GeoDataFrame:
+    """
+    Align the BEN-S1 patches with their BEN-S2 patches in a single `GeoDataFrame`.
+    The S1 rows are hash-joined to the S2 rows via `corresponding_s2_patch` and
+    only patches that exist in both frames are kept, in the order of `s2_gdf`.
+
+    The S2 columns are kept as is, while the S1 `name` is renamed to `s1_name`
+    and the S1-specific `scene_source` and `acquisition_time` columns are added.
+    As the S1 patches share the footprint and labels of their S2 patches,
+    the S1 `labels` and geometries are dropped.
+    """
+    s1_df = pd.DataFrame(
+        s1_gdf[["name", "corresponding_s2_patch", "scene_source", "acquisition_time"]]
+    ).rename(columns={"name": "s1_name"})
+    paired_gdf = s2_gdf.merge(
+        s1_df,
+        how="inner",
+        left_on="name",
+        right_on="corresponding_s2_patch",
+        validate="one_to_one",
+    )
+    return paired_gdf.drop(columns="corresponding_s2_patch")
+
+
+def build_recommended_paired_parquet(
+    ben_s2_path: Path,
+    ben_s1_path: Path,
+    add_metadata: bool = True,
+    output_path: Path = "final_ben_paired.parquet",
+    compact: bool = False,
+    n_workers: Optional[int] = None,
+    target_proj: str = "epsg:3035",
+    verbose: bool = True,
+    io_workers: Optional[int] = None,
+    spatial_sort: bool = False,
+    partitioned: bool = False,
+    multi_hot: bool = False,
+) -> Path:
+    """
+    Generate the recommended GeoDataFrame of the aligned S1 and S2 patches
+    and save it as a single parquet file.
+
+    Both archives are parsed as in `build_recommended_s2_parquet` and
+    `build_recommended_s1_parquet` and each S1 patch is joined to its S2 patch
+    via `pair_ben_gdfs`.
+    If `add_metadata` is set, the metadata of `add_full_ben_s2_metadata` is
+    computed only once per pair, from the S2 patch.
+    Note that the `season` is therefore derived from the S2 `acquisition_date`.
+    If `compact` is set, the output is stored with the compact schema
+    of `to_compact_schema`.
+    If `spatial_sort` is set, the output is sorted along a Hilbert curve and
+    the bbox columns are added, see `spatially_sort_gdf`.
+    If `partitioned` is set, `output_path` is written as directory that is
+    hive-partitioned by `original_split`, `country` and `season`.
+    This requires `add_metadata`. See `write_partitioned_ben_parquet` for details.
+    If `multi_hot` is set, the multi-hot encoded label columns are added as well,
+    see `add_multi_hot_label_columns`.
+
+    `ben_s2_path` and `ben_s1_path` may point to the dataset folders or tar archives.
+    The other options are only for advanced use.
+    """
+    if partitioned and not add_metadata:
+        raise ValueError("The partitioned output requires `add_metadata`!")
+    output_path = Path(output_path).resolve()
+    if partitioned:
+        # fail before parsing the archive
+        _check_partitioned_output_dir(output_path)
+    kwargs = dict(
+        n_workers=n_workers,
+        target_proj=target_proj,
+        verbose=verbose,
+        io_workers=io_workers,
+        name_filter=_is_recommended_patch_name,
     )
+    rich.print("Parsing from json files")
+    rich.print("This may take up to 60min for the entire datasets!")
+    s2_gdf = _get_raw_ben_s2_gdf(ben_s2_path, **kwargs)
+    s1_gdf = _get_raw_ben_s1_gdf(ben_s1_path, **kwargs)
+
+    rich.print("Pairing the S1 and S2 patches")
+    gdf = pair_ben_gdfs(s2_gdf, s1_gdf)
 
     rich.print("Removing discouraged entries")
-    gdf_path = remove_discouraged_parquet_entries(raw_gdf_path)
+    gdf = remove_bad_ben_gdf_entries(gdf)
 
     if add_metadata:
         rich.print("Adding metadata")
-        gdf_path = extend_ben_s1_parquet(gdf_path)
+        gdf = add_full_ben_s2_metadata(gdf, multi_hot=multi_hot)
+    elif multi_hot:
+        gdf = add_multi_hot_label_columns(gdf)
+
+    _write_ben_parquet(gdf, output_path, compact, spatial_sort, partitioned)
+    rich.print(f"Final result written to {output_path}")
+    return output_path
+
+
+# formats of the S2 `acquisition_date` and the S1 `acquisition_time` columns
+_DATE_COL_FORMATS = {
+    "acquisition_date": "%Y-%m-%d %H:%M:%S",
+    "acquisition_time": "%Y-%m-%dT%H:%M:%S",
+}
+
+
+def _build_ben_query_filter(
+    schema: pa.Schema,
+    countries: Optional[List[str]] = None,
+    seasons: Optional[List[Season]] = None,
+    original_splits: Optional[List[Split]] = None,
+    snow: Optional[bool] = None,
+    cloud_or_shadow: Optional[bool] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+) -> Optional[pc.Expression]:
+    """
+    Translate the query of `query_ben_parquet` into a `pyarrow` filter expression
+    for the dataset with the given `schema`.
+    If a filtered column does not exist, a `ValueError` is raised.
+    """
+    filters = []
+
+    def require(col: str) -> pc.Expression:
+        if col not in schema.names:
+            raise ValueError(f"Cannot filter by the missing column `{col}`!")
+        return pc.field(col)
+
+    for col, values in [
+        ("country", countries),
+        ("season", seasons),
+        ("original_split", original_splits),
+    ]:
+        # an empty selection, such as the default of the CLI, is not filtered
+        if values:
+            values = [v.value if isinstance(v, enum.Enum) else v for v in values]
+            filters.append(require(col).isin(values))
+    for col, flag in [("snow", snow), ("cloud_or_shadow", cloud_or_shadow)]:
+        if flag is not None:
+            filters.append(require(col) == flag)
+    if start_date is not None or end_date is not None:
+        date_col = next((c for c in _DATE_COL_FORMATS if c in schema.names), None)
+        if date_col is None:
+            raise ValueError("Cannot filter by date without an acquisition column!")
+        # the fixed-width date strings are ordered chronologically
+        fmt = _DATE_COL_FORMATS[date_col]
+        if start_date is not None:
+            filters.append(pc.field(date_col) >= start_date.strftime(fmt))
+        if end_date is not None:
+            filters.append(pc.field(date_col) < end_date.strftime(fmt))
+    if bbox is not None and set(_BBOX_COLS) <= set(schema.names):
+        minx, miny, maxx, maxy = bbox
+        filters.extend(
+            [
+                pc.field("xmax") >= minx,
+                pc.field("xmin") <= maxx,
+                pc.field("ymax") >= miny,
+                pc.field("ymin") <= maxy,
+            ]
+        )
+    return functools.reduce(lambda a, b: a & b, filters) if filters else None
+
+
+def open_ben_dataset(ben_parquet_path: Path) -> ds.Dataset:
+    """
+    Lazily open a BigEarthNet-style parquet file or hive-partitioned directory
+    of `write_partitioned_ben_parquet` as a `pyarrow.dataset.Dataset`.
+    No data is read until the dataset is scanned, and filters on the partition
+    columns only touch the matching partitions.
+    """
+    return ds.dataset(ben_parquet_path, format="parquet", partitioning="hive")
 
-    shutil.copyfile(gdf_path, output_path)
-    rich.print(f"Final result copied to {output_path}")
+
+@validate_arguments
+def query_ben_parquet(
+    ben_parquet_path: Path,
+    countries: Optional[List[str]] = None,
+    seasons: Optional[List[Season]] = None,
+    original_splits: Optional[List[Split]] = None,
+    snow: Optional[bool] = None,
+    cloud_or_shadow: Optional[bool] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+    columns: Optional[List[str]] = None,
+) -> geopandas.GeoDataFrame:
+    """
+    Load only the matching rows and `columns` of a BigEarthNet-style parquet file.
+    The file is opened as a `pyarrow.dataset`, so the filters are pushed down
+    to the parquet reader, which skips row groups via their statistics
+    and does not read the unselected columns at all.
+
+    The patches can be filtered by any of the given `countries`, `seasons` and
+    `original_splits`, by the `snow` and `cloud_or_shadow` flags and by the
+    acquisition date in `[start_date, end_date)`.
+    A `bbox` (`minx`, `miny`, `maxx`, `maxy` in the projection of the file)
+    selects the patches that intersect it.
+    The bbox filter is pushed down if the file contains the bbox columns of
+    a spatially sorted build, see `spatially_sort_gdf`.
+
+    `ben_parquet_path` may also point to a hive-partitioned directory,
+    whose partitions are then pruned by the filters, see `open_ben_dataset`.
+
+    The geometry column is always loaded.
+    """
+    dataset = open_ben_dataset(ben_parquet_path)
+    filter_expr = _build_ben_query_filter(
+        dataset.schema,
+        countries=countries,
+        seasons=seasons,
+        original_splits=original_splits,
+        snow=snow,
+        cloud_or_shadow=cloud_or_shadow,
+        start_date=start_date,
+        end_date=end_date,
+        bbox=bbox,
+    )
+    if columns:
+        geometry_col = json.loads(dataset.schema.metadata[b"geo"])["primary_column"]
+        columns = [*columns, *([geometry_col] if geometry_col not in columns else [])]
+    else:
+        columns = None
+    table = dataset.to_table(columns=columns, filter=filter_expr)
+    gdf = geopandas.io.arrow._arrow_to_geopandas(
+        table.replace_schema_metadata(dataset.schema.metadata)
+    )
+    if bbox is not None:
+        minx, miny, maxx, maxy = bbox
+        bbox_polygon = box_from_ul_lr_coords(minx, maxy, maxx, miny)
+        gdf = gdf[gdf.intersects(bbox_polygon)].reset_index(drop=True)
+    return gdf
+
+
+@fc.delegates(query_ben_parquet)
+def export_ben_parquet_query(
+    ben_parquet_path: Path,
+    output_path: Path = Path() / "query_ben_gdf.parquet",
+    bbox: Optional[str] = None,
+    verbose: bool = True,
+    **kwargs,
+) -> Path:
+    """
+    Write the result of `query_ben_parquet` for `ben_parquet_path`
+    to `output_path`.
+    Only the matching rows and columns are read from the input file.
+    The `bbox` is given as comma-separated `minx,miny,maxx,maxy` string.
+
+    Returns the resolved output path.
+    """
+    if bbox is not None:
+        bbox = tuple(float(v) for v in bbox.split(","))
+        if len(bbox) != 4:
+            raise ValueError("The bbox must consist of four values!", bbox)
+    gdf = query_ben_parquet(ben_parquet_path, bbox=bbox, **kwargs)
+    output_path = Path(output_path).resolve()
+    _write_ben_parquet(gdf, output_path)
+    if verbose:
+        rich.print(f"[green]Selected {len(gdf)} patches[/green]")
+        rich.print(f"[green]Output written to:\n {output_path}[/green]")
     return output_path
 
 
@@ -762,11 +3349,15 @@ def _run_gdf_cli() -> None:
     app = typer.Typer(rich_markup_mode="markdown")
     app.command()(build_recommended_s1_parquet)
     app.command()(build_recommended_s2_parquet)
+    app.command()(build_recommended_paired_parquet)
     app.command()(build_raw_ben_s1_parquet)
     app.command()(build_raw_ben_s2_parquet)
     app.command()(extend_ben_s1_parquet)
     app.command()(extend_ben_s2_parquet)
+    app.command()(merge_raw_ben_parquet_parts)
     app.command()(remove_discouraged_parquet_entries)
+    app.command()(cache_ben_countries)
+    app.command()(export_ben_parquet_query)
     app()
 
 
@@ -1,21 +1,87 @@
+import json
+import math
+import shutil
+import subprocess
+import sys
+import tarfile
+import warnings
+from datetime import datetime
 from pathlib import Path
 
 import fastcore.all as fc
 import geopandas
 import geopandas.testing
+import numpy as np
 import pandas as pd
 import pandas.testing
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import pytest
-from bigearthnet_common.constants import COUNTRIES, COUNTRIES_ISO_A2
+from bigearthnet_common.base import (
+    get_original_split_from_patch_name,
+    get_s1_patch_directories,
+    get_s1_patches_with_cloud_and_shadow,
+    get_s2_patch_directories,
+    get_s2_patches_with_no_19_class_target,
+    get_s2_patches_with_seasonal_snow,
+    is_cloudy_shadowy_patch,
+    is_snowy_patch,
+    old2new_labels,
+)
+from bigearthnet_common.constants import (
+    COUNTRIES,
+    COUNTRIES_ISO_A2,
+    NEW_LABELS,
+    OLD_LABELS,
+    Split,
+)
 from shapely.geometry import Point, Polygon, box
 
 from bigearthnet_gdf_builder.builder import *
 from bigearthnet_gdf_builder.builder import (
+    _ben_s1_patch_to_record,
+    _ben_s2_patch_to_record,
+    _ben_s2_patches_to_columns,
+    _calibrate_parallel_settings,
     _get_box_from_two_coords,
+    _get_cloud_or_shadow_flags,
     _get_country_borders,
+    _get_original_splits,
+    _get_patch_manifest,
+    _get_snow_flags,
+    _get_tile_ids,
+    _hilbert_distances,
+    _load_ben_countries_gdf,
+    _read_cached_gdf,
+    _records_to_columns,
+    _resolve_parallel_settings,
+    _tile_table_path,
+    _write_gdf_chunks_to_parquet,
 )
 
 
+@pytest.fixture(autouse=True)
+def user_dir(tmp_path, monkeypatch) -> Path:
+    """
+    Keep the listing indexes, raw builds and country caches of the tests
+    out of the real `USER_DIR`.
+    """
+    user_dir = tmp_path / "user_data"
+    monkeypatch.setattr("bigearthnet_gdf_builder.builder.USER_DIR", user_dir)
+    monkeypatch.setattr(
+        "bigearthnet_gdf_builder.builder.LISTINGS_DIR", user_dir / "listings"
+    )
+    monkeypatch.setattr(
+        "bigearthnet_gdf_builder.builder.COUNTRIES_CACHE_DIR",
+        user_dir / "country_borders",
+    )
+    # `appdirs` resolves the `USER_DIR` of subprocesses from `XDG_DATA_HOME`
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "xdg_data"))
+    _load_ben_countries_gdf.cache_clear()
+    yield user_dir
+    _load_ben_countries_gdf.cache_clear()
+
+
 @pytest.fixture
 def test_dataset_path() -> Path:
     return Path(__file__).parent.resolve() / Path("datasets/tiny/")
@@ -84,6 +150,31 @@ def ben_bounds() -> geopandas.GeoSeries:
     return geopandas.GeoSeries([ben_bounds_geom], crs="EPSG:3035")
 
 
+@pytest.fixture
+def ben_borders_path(tmp_path) -> Path:
+    """
+    Local borders file with coarse boxes for some countries,
+    to avoid downloading the naturalearthdata borders.
+    """
+    borders = geopandas.GeoDataFrame(
+        {
+            "ISO_A3": ["AUT", "CHE", "PRT", "DEU"],
+            "ISO_A2": ["AT", "CH", "PT", "DE"],
+            "NAME": ["Austria", "Switzerland", "Portugal", "Germany"],
+            "geometry": [
+                box(9.5, 46.4, 17.2, 49.0),
+                box(5.9, 45.8, 9.5, 47.8),
+                box(-9.6, 36.9, -6.2, 42.2),
+                box(5.9, 49.0, 15.0, 55.1),
+            ],
+        },
+        crs="epsg:4326",
+    )
+    path = tmp_path / "borders.parquet"
+    borders.to_parquet(path)
+    return path
+
+
 def test_get_box():
     box1 = _get_box_from_two_coords([0, 0], [2, 2])
     box2 = _get_box_from_two_coords([2, 2], [0, 0])
@@ -99,6 +190,15 @@ def test_box_from_ul_lr_coords():
     assert b1.equals(b2)
 
 
+def test_boxes_from_ul_lr_coords():
+    boxes = boxes_from_ul_lr_coords(
+        ulx=np.array([0, 2]), uly=np.array([4, 6]), lrx=[4, 8], lry=[0, 1]
+    )
+    assert len(boxes) == 2
+    fc.test_eq(boxes[0], box_from_ul_lr_coords(ulx=0, uly=4, lrx=4, lry=0))
+    fc.test_eq(boxes[1], box(2, 1, 8, 6))
+
+
 def test_reprojection():
     north_east_crs = "epsg:2953"
     enc_point = Point(1099489.55, 9665176.75)
@@ -113,6 +213,29 @@ def test_reprojection():
     fc.test_close([long, lat], [ref_long, ref_lat], eps=0.1)
 
 
+def test_reproject_ul_lr_coords():
+    df = pd.DataFrame(
+        {
+            "ulx": [604800, 604800, 300000],
+            "uly": [5834040, 5834040, 5500000],
+            "lrx": [606000, 606000, 301200],
+            "lry": [5832840, 5832840, 5498800],
+            "projection": ["epsg:32629", "epsg:32634", "epsg:32629"],
+        }
+    )
+    geoms = reproject_ul_lr_coords(df, "epsg:3035")
+    ref_geoms = pd.concat(
+        [
+            geopandas.GeoSeries(
+                [box_from_ul_lr_coords(*row[:4])], crs=row[4], index=[i]
+            ).to_crs("epsg:3035")
+            for i, row in enumerate(df.itertuples(index=False))
+        ]
+    )
+    geopandas.testing.assert_geoseries_equal(geoms, ref_geoms)
+    assert geoms.geom_equals_exact(ref_geoms, tolerance=0).all()
+
+
 def test_ben_s2_gdf_patch_to_gdf(test_json_path):
     gdf = ben_s2_patch_to_gdf(test_json_path)
     gdf2 = ben_s2_patch_to_gdf(test_json_path.parent)
@@ -147,6 +270,62 @@ def test_ben_s1_patch_to_gdf(test_s1_json_path):
     geopandas.testing.assert_geodataframe_equal(gdf_s1, gdf_s1_parent)
 
 
+@pytest.mark.parametrize("json_loads", [json.loads, None])
+def test_read_ben_json_columns(
+    monkeypatch, test_dataset_path, test_dataset_s1_path, json_loads
+):
+    if json_loads is not None:
+        monkeypatch.setattr("bigearthnet_gdf_builder.builder._json_loads", json_loads)
+    for patch_paths, columns_reader, record_reader in [
+        (
+            get_s2_patch_directories(test_dataset_path),
+            read_ben_s2_json_columns,
+            _ben_s2_patch_to_record,
+        ),
+        (
+            get_s1_patch_directories(test_dataset_s1_path),
+            read_ben_s1_json_columns,
+            _ben_s1_patch_to_record,
+        ),
+    ]:
+        ref_columns = _records_to_columns([record_reader(p) for p in patch_paths])
+        json_paths = [p / f"{p.name}_labels_metadata.json" for p in patch_paths]
+        for paths in [patch_paths, json_paths]:
+            columns = columns_reader(paths)
+            assert list(columns) == list(ref_columns)
+            assert columns == ref_columns
+        assert columns_reader(patch_paths, io_threads=4) == ref_columns
+
+
+def test_read_ben_json_columns_invalid_json(tmp_path):
+    json_path = tmp_path / "S2A_MSIL2A_20170617T113321_4_55_labels_metadata.json"
+    json_path.write_text("{")
+    with pytest.raises(ValueError) as excinfo:
+        read_ben_s2_json_columns([json_path])
+    assert excinfo.value.args == ("Error trying to read json from: ", json_path)
+    assert isinstance(excinfo.value.__cause__, ValueError)
+
+
+def test_discover_patch_directories(
+    tmp_path, monkeypatch, user_dir, test_dataset_path, test_dataset_s1_path
+):
+    for dir_path, discover, get_dirs in [
+        (test_dataset_path, discover_s2_patch_directories, get_s2_patch_directories),
+        (test_dataset_s1_path, discover_s1_patch_directories, get_s1_patch_directories),
+    ]:
+        assert discover(dir_path) == get_dirs(dir_path)
+
+    ben_path = tmp_path / "ben"
+    shutil.copytree(test_dataset_path, ben_path)
+    patch_paths = discover_s2_patch_directories(ben_path)
+    with monkeypatch.context() as m:
+        m.setattr("bigearthnet_gdf_builder.builder._scan_patch_names", None)
+        assert discover_s2_patch_directories(ben_path) == patch_paths
+    shutil.rmtree(patch_paths[0])
+    assert discover_s2_patch_directories(ben_path) == patch_paths[1:]
+    assert len(list((user_dir / "listings").glob("*.json"))) == 3
+
+
 def test_get_gdf_from_s2_patch_dir(test_dataset_path, ben_bounds):
     gdf = get_gdf_from_s2_patch_dir(test_dataset_path)
     assert gdf.within(ben_bounds.iloc[0]).all()
@@ -163,6 +342,83 @@ def test_build_gdf_from_s2_patch_paths(test_folder_path):
     geopandas.testing.assert_geodataframe_equal(gdf1, gdf2)
 
 
+def test_build_gdf_from_s1_patch_paths(test_s1_folder_path):
+    gdf1 = ben_s1_patch_to_reprojected_gdf(test_s1_folder_path)
+    gdf2 = build_gdf_from_s1_patch_paths([test_s1_folder_path], n_workers=2)
+    geopandas.testing.assert_geodataframe_equal(gdf1, gdf2)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1024])
+def test_chunked_build_matches_patch_wise_build(test_dataset_path, chunk_size):
+    paths = get_s2_patch_directories(test_dataset_path)
+    gdf1 = pd.concat(
+        [ben_s2_patch_to_reprojected_gdf(p) for p in paths], ignore_index=True
+    )
+    gdf2 = build_gdf_from_s2_patch_paths(
+        paths, n_workers=2, chunk_size=chunk_size, progress=False
+    )
+    geopandas.testing.assert_geodataframe_equal(gdf1, gdf2)
+    assert gdf1.geometry.geom_equals_exact(gdf2.geometry, tolerance=0).all()
+
+
+@pytest.mark.parametrize("io_workers", [1, 3, 64])
+def test_build_with_io_workers(tmp_path, test_dataset_path, io_workers):
+    paths = get_s2_patch_directories(test_dataset_path)
+    ref_gdf = build_gdf_from_s2_patch_paths(paths, n_workers=2, progress=False)
+    gdf = build_gdf_from_s2_patch_paths(
+        paths, n_workers=2, chunk_size=3, io_workers=io_workers, progress=False
+    )
+    geopandas.testing.assert_geodataframe_equal(gdf, ref_gdf)
+
+    p = build_raw_ben_s2_parquet(
+        test_dataset_path,
+        output_path=tmp_path / "raw_ben_gdf.parquet",
+        n_workers=2,
+        row_group_size=4,
+        io_workers=io_workers,
+    )
+    geopandas.testing.assert_geodataframe_equal(geopandas.read_parquet(p), ref_gdf)
+
+
+def test_auto_tuned_parallel_settings(monkeypatch, test_dataset_path):
+    paths = get_s2_patch_directories(test_dataset_path)
+    monkeypatch.setattr("bigearthnet_gdf_builder.builder._available_cores", lambda: 64)
+    n_workers, chunk_size = _calibrate_parallel_settings(
+        paths, _ben_s2_patches_to_columns
+    )
+    assert 1 <= n_workers <= len(paths)
+    assert 16 <= chunk_size <= 4096
+
+    # parsing 64 patches takes 6.4s, which would be enough work for 6 workers,
+    # but the minimal chunk size only results in 4 chunks
+    clock = iter([0.0, 6.4])
+    n_workers, chunk_size = _calibrate_parallel_settings(
+        [Path(str(i)) for i in range(64)], lambda paths: {}, clock=lambda: next(clock)
+    )
+    assert (n_workers, chunk_size) == (4, 16)
+    monkeypatch.undo()
+    assert _resolve_parallel_settings(paths, None, 3, 5) == (3, 5)
+
+    gdf = build_gdf_from_s2_patch_paths(paths, progress=False)
+    ref_gdf = build_gdf_from_s2_patch_paths(
+        paths, n_workers=2, chunk_size=1024, progress=False
+    )
+    geopandas.testing.assert_geodataframe_equal(gdf, ref_gdf)
+
+
+def test_build_raw_s2_parquet_quiet(tmp_path, capsys, test_dataset_path):
+    build_raw_ben_s2_parquet(
+        test_dataset_path, output_path=tmp_path / "raw_ben_gdf.parquet", verbose=False
+    )
+    captured = capsys.readouterr()
+    assert captured.out == captured.err == ""
+
+
+def test_build_gdf_from_empty_patch_paths():
+    with pytest.raises(ValueError):
+        build_gdf_from_s2_patch_paths([])
+
+
 def test_get_country_borders():
     countries = _get_country_borders()
     assert len(countries[countries["NAME"].isin(COUNTRIES)]) == len(COUNTRIES)
@@ -172,6 +428,38 @@ def test_get_country_borders():
     )
 
 
+def test_cache_ben_countries(ben_borders_path):
+    cache_dir = cache_ben_countries(ben_borders_path, verbose=False)
+    cached_files = sorted(cache_dir.iterdir())
+    # the cache files are replaced atomically without leaving temporary files behind
+    assert {p.name for p in cached_files if p.name.startswith("tmp")} == set()
+    # an invalid path keeps the working cache
+    with pytest.raises(FileNotFoundError):
+        cache_ben_countries(ben_borders_path.with_name("missing.zip"), verbose=False)
+    assert sorted(cache_dir.iterdir()) == cached_files
+    countries = get_ben_countries_gdf()
+    assert countries["NAME"].tolist() == ["Austria", "Switzerland", "Portugal"]
+    assert countries.crs == "epsg:4326"
+    countries_3035 = get_ben_countries_gdf("epsg:3035")
+    assert countries_3035.crs == "epsg:3035"
+    geopandas.testing.assert_geodataframe_equal(
+        countries_3035, countries.to_crs("epsg:3035")
+    )
+
+    # only served from the in-memory and on-disk caches from now on
+    cached_paths = sorted(cache_dir.glob("*.parquet"))
+    assert len(cached_paths) == 2
+    _load_ben_countries_gdf.cache_clear()
+    geopandas.testing.assert_geodataframe_equal(
+        get_ben_countries_gdf("epsg:3035"), countries_3035
+    )
+    for path in cached_paths:
+        with open(path, "ab") as fp:
+            fp.write(b"corrupted")
+        with pytest.warns(RuntimeWarning):
+            assert _read_cached_gdf(path) is None
+
+
 def test_assign_to_ben_country():
     g = geopandas.GeoDataFrame(
         {
@@ -220,6 +508,16 @@ def test_tfm_month_to_season():
     ]
 
 
+def test_tfm_month_to_season_categorical():
+    dates = pd.Series(["2018-12-01", "2018-03-01", None], index=[3, 1, 2])
+    with pytest.raises(ValueError):
+        tfm_month_to_season(dates)
+    seasons = tfm_month_to_season(dates.iloc[:2])
+    assert seasons.dtype == "category"
+    assert seasons.cat.categories.tolist() == [s.value for s in Season]
+    assert seasons.index.tolist() == [3, 1]
+
+
 def test_filter_season():
     dates_df = pd.DataFrame(
         {
@@ -256,6 +554,58 @@ def test_add_full_ben_s1_metadata(test_dataset_s1_path):
     assert set(metadata_gdf.columns.to_list()) & metadata_cols == metadata_cols
 
 
+def test_vectorized_patch_flags(test_dataset_path, test_dataset_s1_path):
+    names = [p.name for p in get_s2_patch_directories(test_dataset_path)]
+    names += [p.name for p in get_s1_patch_directories(test_dataset_s1_path)]
+    names += sorted(get_s2_patches_with_seasonal_snow())[:2]
+    names += sorted(get_s1_patches_with_cloud_and_shadow())[:2]
+    names = pd.Series(names)
+    np.testing.assert_array_equal(
+        _get_snow_flags(names), names.apply(is_snowy_patch).to_numpy()
+    )
+    np.testing.assert_array_equal(
+        _get_cloud_or_shadow_flags(names),
+        names.apply(is_cloudy_shadowy_patch).to_numpy(),
+    )
+    with pytest.warns(UserWarning):
+        splits = _get_original_splits(names)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        ref_splits = names.apply(get_original_split_from_patch_name).tolist()
+    assert splits.tolist() == ref_splits
+
+
+def test_tfm_old2new_labels(test_dataset_path):
+    gdf = get_gdf_from_s2_patch_dir(test_dataset_path)
+    labels = pd.concat([gdf["labels"]] * 3, ignore_index=True)
+    labels[1] = ["Airports"]
+    with pytest.warns(UserWarning):
+        new_labels = tfm_old2new_labels(labels)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        assert new_labels.tolist() == labels.apply(old2new_labels).tolist()
+    # the rows with the same labels do not share their lists
+    n = len(gdf)
+    assert new_labels[0] == new_labels[n] and new_labels[0] is not new_labels[n]
+
+
+def test_labels_to_multi_hot():
+    labels = pd.Series([["Arable land", "Agro-forestry areas"], None, []])
+    masks = labels_to_multi_hot(labels, NEW_LABELS)
+    assert masks.dtype == np.uint64
+    assert masks.tolist() == [0b11, 0, 0]
+    with pytest.raises(KeyError):
+        labels_to_multi_hot(pd.Series([["unknown"]]), NEW_LABELS)
+
+
+def test_add_multi_hot_label_columns(test_dataset_path):
+    gdf = add_multi_hot_label_columns(get_gdf_from_s2_patch_dir(test_dataset_path))
+    for col, label_names in [("labels", OLD_LABELS), ("new_labels", NEW_LABELS)]:
+        for labels, mask in zip(gdf[col], gdf[f"{col}_multi_hot"]):
+            decoded = [l for i, l in enumerate(label_names) if int(mask) >> i & 1]
+            assert decoded == sorted(labels)
+
+
 # TODO: Manually add some negative examples!
 def test_remove_bad_ben_gdf_entries(test_dataset_path):
     gdf1 = get_gdf_from_s2_patch_dir(test_dataset_path)
@@ -277,6 +627,314 @@ def test_build_recommended_s2_parquet(tmp_path, test_dataset_path):
     assert t.stat().st_size > 0
 
 
+@pytest.mark.parametrize("compact", [False, True])
+def test_fused_recommended_pipeline(
+    tmp_path, ben_borders_path, test_dataset_path, test_dataset_s1_path, compact
+):
+    cache_ben_countries(ben_borders_path, verbose=False)
+    for dataset_path, recommended_builder, raw_builder, extender, raw_name in [
+        (
+            test_dataset_path,
+            build_recommended_s2_parquet,
+            build_raw_ben_s2_parquet,
+            extend_ben_s2_parquet,
+            "raw_ben_s2_gdf.parquet",
+        ),
+        (
+            test_dataset_s1_path,
+            build_recommended_s1_parquet,
+            build_raw_ben_s1_parquet,
+            extend_ben_s1_parquet,
+            "raw_ben_s1_gdf.parquet",
+        ),
+    ]:
+        staged_dir = tmp_path / "staged"
+        staged_dir.mkdir(exist_ok=True)
+        raw_path = raw_builder(
+            dataset_path, output_path=staged_dir / "raw.parquet", compact=compact
+        )
+        cleaned_path = remove_discouraged_parquet_entries(raw_path, compact=compact)
+        ref_gdf = geopandas.read_parquet(extender(cleaned_path, compact=compact))
+
+        p = recommended_builder(
+            dataset_path, output_path=tmp_path / "fused.parquet", compact=compact
+        )
+        geopandas.testing.assert_geodataframe_equal(
+            geopandas.read_parquet(p), ref_gdf, check_like=True
+        )
+
+        checkpoint_dir = tmp_path / "checkpoints"
+        p = recommended_builder(
+            dataset_path,
+            output_path=tmp_path / "checkpointed.parquet",
+            compact=compact,
+            checkpoint_dir=checkpoint_dir,
+        )
+        geopandas.testing.assert_geodataframe_equal(
+            geopandas.read_parquet(p), ref_gdf, check_like=True
+        )
+        assert {p.name for p in checkpoint_dir.glob("*_gdf.parquet")} >= {
+            raw_name,
+            "cleaned_ben_gdf.parquet",
+        }
+        assert (checkpoint_dir / "cleaned_ben_gdf.index.npy").exists()
+
+
+def test_skip_discouraged_patches(tmp_path, test_dataset_path):
+    ben_path = tmp_path / "ben"
+    shutil.copytree(test_dataset_path, ben_path)
+    # broken json files of discouraged patches must never be read
+    for name in [
+        sorted(get_s2_patches_with_seasonal_snow())[0],
+        sorted(get_s2_patches_with_no_19_class_target())[0],
+    ]:
+        (ben_path / name).mkdir()
+        (ben_path / name / f"{name}_labels_metadata.json").write_text("{")
+
+    with pytest.raises(ValueError):
+        build_raw_ben_s2_parquet(ben_path, output_path=tmp_path / "raw.parquet")
+    p = build_raw_ben_s2_parquet(
+        ben_path, output_path=tmp_path / "raw.parquet", skip_discouraged=True
+    )
+    ref_gdf = get_gdf_from_s2_patch_dir(test_dataset_path)
+    geopandas.testing.assert_geodataframe_equal(
+        geopandas.read_parquet(p).sort_values("name", ignore_index=True),
+        ref_gdf.sort_values("name", ignore_index=True),
+    )
+
+
+def test_build_recommended_paired_parquet(
+    tmp_path, ben_borders_path, test_dataset_path, test_dataset_s1_path
+):
+    cache_ben_countries(ben_borders_path, verbose=False)
+    # pair the tiny S1 patches with the last tiny S2 patches
+    s2_names = sorted(p.name for p in get_s2_patch_directories(test_dataset_path))
+    s1_path = tmp_path / "s1"
+    shutil.copytree(test_dataset_s1_path, s1_path)
+    s1_names = sorted(p.name for p in get_s1_patch_directories(s1_path))
+    pairs = dict(zip(s1_names, s2_names[::-1]))
+    for s1_name, s2_name in pairs.items():
+        json_path = s1_path / s1_name / f"{s1_name}_labels_metadata.json"
+        data = json.loads(json_path.read_text())
+        data["corresponding_s2_patch"] = s2_name
+        json_path.write_text(json.dumps(data))
+
+    p = build_recommended_paired_parquet(
+        test_dataset_path, s1_path, output_path=tmp_path / "paired.parquet"
+    )
+    gdf = geopandas.read_parquet(p)
+    assert dict(zip(gdf["s1_name"], gdf["name"])) == pairs
+    s1_gdf = get_gdf_from_s1_patch_dir(s1_path).set_index("name")
+    assert (
+        gdf["scene_source"].tolist()
+        == s1_gdf.loc[gdf["s1_name"], "scene_source"].tolist()
+    )
+
+    s2_gdf = get_gdf_from_s2_patch_dir(test_dataset_path)
+    s2_gdf = s2_gdf[s2_gdf["name"].isin(pairs.values())].reset_index(drop=True)
+    ref_gdf = add_full_ben_s2_metadata(remove_bad_ben_gdf_entries(s2_gdf))
+    geopandas.testing.assert_geodataframe_equal(
+        gdf.drop(columns=["s1_name", "scene_source", "acquisition_time"]),
+        ref_gdf,
+        check_like=True,
+    )
+
+    p = build_recommended_paired_parquet(
+        test_dataset_path,
+        s1_path,
+        add_metadata=False,
+        output_path=tmp_path / "paired_multi_hot.parquet",
+        multi_hot=True,
+    )
+    gdf = geopandas.read_parquet(p)
+    assert (
+        gdf["labels_multi_hot"] == labels_to_multi_hot(gdf["labels"], OLD_LABELS)
+    ).all()
+
+
+@pytest.mark.parametrize("add_metadata", [True, False])
+def test_build_recommended_multi_hot(
+    tmp_path, ben_borders_path, test_dataset_path, add_metadata
+):
+    cache_ben_countries(ben_borders_path, verbose=False)
+    p = build_recommended_s2_parquet(
+        test_dataset_path,
+        add_metadata=add_metadata,
+        output_path=tmp_path / "final.parquet",
+        multi_hot=True,
+        compact=True,
+    )
+    gdf = geopandas.read_parquet(p)
+    assert (
+        gdf["labels_multi_hot"] == labels_to_multi_hot(gdf["labels"], OLD_LABELS)
+    ).all()
+    assert (
+        gdf["new_labels_multi_hot"]
+        == labels_to_multi_hot(gdf["new_labels"], NEW_LABELS)
+    ).all()
+    assert ("country" in gdf.columns) == add_metadata
+
+
+def test_hilbert_distances():
+    xs, ys = np.meshgrid(range(8), range(8))
+    d = _hilbert_distances(xs.ravel(), ys.ravel(), level=3)
+    assert sorted(d) == list(range(64))
+    order = np.argsort(d)
+    steps = np.abs(np.diff(np.c_[xs.ravel()[order], ys.ravel()[order]], axis=0))
+    # consecutive cells along the curve are always direct neighbors
+    assert (steps.sum(axis=1) == 1).all()
+
+
+def test_build_raw_s2_parquet_spatially_sorted(
+    tmp_path, monkeypatch, test_dataset_path
+):
+    monkeypatch.setattr("bigearthnet_gdf_builder.builder._SPATIAL_ROW_GROUP_SIZE", 4)
+    p = build_raw_ben_s2_parquet(
+        test_dataset_path,
+        output_path=tmp_path / "raw_ben_gdf.parquet",
+        spatial_sort=True,
+    )
+    gdf = geopandas.read_parquet(p)
+    ref_gdf = get_gdf_from_s2_patch_dir(test_dataset_path)
+    assert sorted(gdf["name"]) == sorted(ref_gdf["name"])
+    bounds = gdf.geometry.bounds
+    np.testing.assert_array_equal(
+        gdf[["xmin", "ymin", "xmax", "ymax"]].to_numpy(), bounds.to_numpy()
+    )
+
+    metadata = pq.ParquetFile(p).metadata
+    assert metadata.num_row_groups == math.ceil(len(gdf) / 4)
+    xmin_idx = metadata.schema.names.index("xmin")
+    for i in range(metadata.num_row_groups):
+        stats = metadata.row_group(i).column(xmin_idx).statistics
+        rows = gdf["xmin"].iloc[i * 4 : (i + 1) * 4]
+        assert (stats.min, stats.max) == (rows.min(), rows.max())
+
+    with pytest.raises(ValueError):
+        build_raw_ben_s2_parquet(
+            test_dataset_path,
+            output_path=tmp_path / "raw_ben_gdf.parquet",
+            spatial_sort=True,
+            row_group_size=4,
+        )
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_query_ben_parquet(tmp_path, ben_borders_path, test_dataset_path, compact):
+    cache_ben_countries(ben_borders_path, verbose=False)
+    raw_path = build_raw_ben_s2_parquet(
+        test_dataset_path, output_path=tmp_path / "raw.parquet", verbose=False
+    )
+    path = extend_ben_s2_parquet(raw_path, compact=compact, spatial_sort=True)
+    gdf = geopandas.read_parquet(path)
+    for col in ["country", "season", "original_split", "acquisition_date"]:
+        gdf[col] = gdf[col].astype(object)
+
+    country, season = gdf["country"].iloc[0], gdf["season"].iloc[0]
+    result = query_ben_parquet(
+        path,
+        countries=[country],
+        seasons=[season],
+        snow=False,
+        start_date=datetime(2017, 6, 1),
+        end_date=datetime(2018, 1, 1),
+        columns=["name", "country"],
+    )
+    expected = gdf[
+        (gdf["country"] == country)
+        & (gdf["season"] == season)
+        & ~gdf["snow"]
+        & (gdf["acquisition_date"] >= "2017-06-01")
+        & (gdf["acquisition_date"] < "2018-01-01")
+    ]
+    assert len(expected) > 0
+    assert result["name"].tolist() == expected["name"].tolist()
+    assert result.columns.tolist() == ["name", "country", "geometry"]
+    assert isinstance(result, geopandas.GeoDataFrame)
+
+    splits = query_ben_parquet(path, original_splits=[Split.train, Split.test])
+    assert (
+        splits["name"].tolist()
+        == gdf[gdf["original_split"].isin(["train", "test"])]["name"].tolist()
+    )
+
+    center = gdf.geometry.iloc[0].centroid
+    bbox = (center.x - 1, center.y - 1, center.x + 1, center.y + 1)
+    for p in [path, raw_path]:
+        result = query_ben_parquet(p, bbox=bbox)
+        assert result["name"].tolist() == [gdf["name"].iloc[0]]
+
+    with pytest.raises(ValueError):
+        query_ben_parquet(raw_path, countries=[country])
+
+
+def test_partitioned_recommended_output(tmp_path, ben_borders_path, test_dataset_path):
+    cache_ben_countries(ben_borders_path, verbose=False)
+    ref_gdf = geopandas.read_parquet(
+        build_recommended_s2_parquet(
+            test_dataset_path, output_path=tmp_path / "final.parquet"
+        )
+    )
+    output_dir = tmp_path / "final"
+    for _ in range(2):
+        # rebuilding replaces the previous partitions
+        build_recommended_s2_parquet(
+            test_dataset_path, output_path=output_dir, partitioned=True
+        )
+    part_paths = list(output_dir.rglob("*.parquet"))
+    assert len(part_paths) == len(
+        ref_gdf.groupby(["original_split", "country", "season"], dropna=False)
+    )
+    for part_path in part_paths:
+        rel_parts = part_path.relative_to(output_dir).parts
+        assert [p.split("=")[0] for p in rel_parts[:-1]] == [
+            "original_split",
+            "country",
+            "season",
+        ]
+
+    gdf = query_ben_parquet(output_dir).sort_values("name", ignore_index=True)
+    ref_gdf = ref_gdf.sort_values("name", ignore_index=True)
+    for col in ["original_split", "country", "season"]:
+        assert gdf[col].tolist() == [
+            None if v is None else str(v) for v in ref_gdf[col]
+        ]
+    geopandas.testing.assert_geodataframe_equal(
+        gdf.drop(columns=["original_split", "country", "season"]),
+        ref_gdf.drop(columns=["original_split", "country", "season"]),
+        check_like=True,
+    )
+
+    country = ref_gdf["country"].iloc[0]
+    dataset = open_ben_dataset(output_dir)
+    fragments = list(dataset.get_fragments(filter=ds.field("country") == country))
+    assert 0 < len(fragments) < len(part_paths)
+    result = query_ben_parquet(output_dir, countries=[country])
+    assert sorted(result["name"]) == sorted(
+        ref_gdf[ref_gdf["country"] == country]["name"]
+    )
+
+    with pytest.raises(ValueError):
+        build_recommended_s2_parquet(
+            test_dataset_path,
+            output_path=output_dir,
+            add_metadata=False,
+            partitioned=True,
+        )
+    # the output of a previous non-partitioned build is not overwritten
+    output_file = tmp_path / "final_ben_s2.parquet"
+    output_file.write_bytes(b"")
+    for write in [
+        lambda: build_recommended_s2_parquet(
+            test_dataset_path, output_path=output_file, partitioned=True
+        ),
+        lambda: write_partitioned_ben_parquet(ref_gdf, output_file),
+    ]:
+        with pytest.raises(ValueError, match="Choose a different output path"):
+            write()
+    assert output_file.is_file()
+
+
 def test_build_raw_s2_parquet(tmp_path, test_dataset_path):
     p = build_raw_ben_s2_parquet(
         test_dataset_path, output_path=tmp_path / "raw_ben_gdf.parquet"
@@ -284,6 +942,101 @@ def test_build_raw_s2_parquet(tmp_path, test_dataset_path):
     assert p.stat().st_size > 0
 
 
+def test_patch_name_index(tmp_path, monkeypatch, ben_borders_path, test_dataset_path):
+    cache_ben_countries(ben_borders_path, verbose=False)
+    output_path = build_raw_ben_s2_parquet(
+        test_dataset_path, output_path=tmp_path / "raw_ben_gdf.parquet", n_workers=1
+    )
+    index_path = output_path.with_suffix(".index.npy")
+    assert index_path.exists()
+
+    names = pd.Index(pq.read_table(output_path, columns=["name"])["name"].to_pylist())
+    index = get_patch_name_index(output_path)
+    assert len(index) == len(names)
+    for name in names:
+        assert index.get_row(name) == names.get_loc(name)
+    assert "missing" not in index
+    assert names[0] + "_suffix" not in index
+    with pytest.raises(KeyError):
+        index.get_row("missing")
+    np.testing.assert_array_equal(
+        index.get_rows([names[-1], "missing", names[0]]), [len(names) - 1, -1, 0]
+    )
+
+    lookup = BenMetadataLookup(output_path, columns=["name", "labels"])
+    assert lookup[names[1]]["name"] == names[1]
+    df = lookup.get_rows(names[::-1])
+    assert df["name"].tolist() == names[::-1].tolist()
+    with pytest.raises(KeyError):
+        lookup.get_rows(["missing"])
+
+    # duplicated names only skip the index of the builders
+    dup_path = tmp_path / "dup" / "raw_ben_gdf.parquet"
+    dup_path.parent.mkdir()
+    gdf = geopandas.read_parquet(output_path)
+    pd.concat([gdf, gdf.iloc[:1]], ignore_index=True).to_parquet(dup_path)
+    with pytest.raises(ValueError):
+        write_patch_name_index(dup_path)
+    with pytest.warns(RuntimeWarning, match="not unique"):
+        p = extend_ben_s2_parquet(dup_path, verbose=False)
+    assert p.exists()
+    assert not p.with_suffix(".index.npy").exists()
+
+    # a stale index is rebuilt
+    gdf = geopandas.read_parquet(output_path).iloc[::-1]
+    gdf.to_parquet(output_path)
+    assert get_patch_name_index(output_path).get_row(names[0]) == len(names) - 1
+
+    # an index that cannot be written is kept in memory
+    def read_only(path, write):
+        raise PermissionError(path)
+
+    gdf.iloc[::-1].to_parquet(output_path)
+    with monkeypatch.context() as m:
+        m.setattr("bigearthnet_gdf_builder.builder._replace_atomically", read_only)
+        assert get_patch_name_index(output_path).get_row(names[0]) == 0
+    assert index_path.stat().st_mtime_ns < output_path.stat().st_mtime_ns
+
+    # all parquet outputs get their index
+    cleaned_path = remove_discouraged_parquet_entries(output_path, verbose=False)
+    assert cleaned_path.with_suffix(".index.npy").exists()
+    query_path = export_ben_parquet_query(
+        output_path, output_path=tmp_path / "query.parquet", verbose=False
+    )
+    assert query_path.with_suffix(".index.npy").exists()
+    query_path = export_ben_parquet_query(
+        output_path,
+        output_path=tmp_path / "query.parquet",
+        columns=["labels"],
+        verbose=False,
+    )
+    assert not query_path.with_suffix(".index.npy").exists()
+
+
+def test_patch_name_index_matches_pandas(tmp_path):
+    rng = np.random.default_rng(0)
+    names = [f"S2A_MSIL2A_2017{i:05d}_{rng.integers(100)}" for i in range(2000)]
+    names = pd.Index(rng.permutation(names))
+    df = pd.DataFrame({"name": names, "value": rng.random(len(names))})
+    path = tmp_path / "names.parquet"
+    df.to_parquet(path)
+
+    index = get_patch_name_index(path)
+    queries = [*names[::7], "missing", names[0][:-1], names[0] + "0", "S2Ä", ""]
+    ref_rows = names.get_indexer(queries)
+    np.testing.assert_array_equal(index.get_rows(queries), ref_rows)
+    for query, ref_row in zip(queries, ref_rows):
+        assert (query in index) == (ref_row >= 0)
+        if ref_row >= 0:
+            assert index.get_row(query) == ref_row
+
+    lookup = BenMetadataLookup(path)
+    for row in df.iloc[::97].to_dict("records"):
+        assert lookup[row["name"]] == row
+    with pytest.raises(KeyError):
+        lookup["missing"]
+
+
 def test_build_recommended_s1_parquet(tmp_path, test_dataset_s1_path):
     t = build_recommended_s1_parquet(
         test_dataset_s1_path, output_path=tmp_path / "out.parquet"
@@ -296,3 +1049,291 @@ def test_build_raw_s1_parquet(tmp_path, test_dataset_s1_path):
         test_dataset_s1_path, output_path=tmp_path / "raw_ben_gdf.parquet"
     )
     assert p.stat().st_size > 0
+
+
+def test_compact_schema_round_trip(tmp_path, ben_borders_path, test_dataset_path):
+    cache_ben_countries(ben_borders_path, verbose=False)
+    gdf = add_full_ben_s2_metadata(get_gdf_from_s2_patch_dir(test_dataset_path))
+    compact_gdf = to_compact_schema(gdf.copy())
+    for col in ["country", "season", "original_split", "acquisition_date"]:
+        assert compact_gdf[col].dtype == "category"
+    assert compact_gdf["snow"].dtype == bool
+
+    compact_gdf.to_parquet(tmp_path / "compact.parquet")
+    read_gdf = geopandas.read_parquet(tmp_path / "compact.parquet")
+    geopandas.testing.assert_geodataframe_equal(read_gdf, compact_gdf)
+    for col in ["country", "season", "original_split", "acquisition_date"]:
+        assert read_gdf[col].astype(object).tolist() == [
+            None if v is None else str(v) for v in gdf[col]
+        ]
+
+
+def test_build_raw_s2_parquet_compact(tmp_path, test_dataset_path):
+    p = build_raw_ben_s2_parquet(
+        test_dataset_path, output_path=tmp_path / "raw.parquet", compact=True
+    )
+    p_stream = build_raw_ben_s2_parquet(
+        test_dataset_path,
+        output_path=tmp_path / "raw_stream.parquet",
+        compact=True,
+        row_group_size=4,
+    )
+    gdf = geopandas.read_parquet(p)
+    stream_gdf = geopandas.read_parquet(p_stream)
+    assert gdf["tile_source"].dtype == "category"
+    assert stream_gdf["tile_source"].dtype == "category"
+    # the categories of each row group are merged in a different order
+    as_object = {"tile_source": object, "acquisition_date": object}
+    geopandas.testing.assert_geodataframe_equal(
+        stream_gdf.astype(as_object), gdf.astype(as_object)
+    )
+
+
+def test_build_raw_s2_parquet_incremental(tmp_path, test_dataset_path):
+    ben_path = tmp_path / "ben"
+    shutil.copytree(test_dataset_path, ben_path)
+    output_path = tmp_path / "raw_ben_gdf.parquet"
+    build_raw_ben_s2_parquet(ben_path, output_path=output_path, incremental=True)
+
+    patch_paths = get_s2_patch_directories(ben_path)
+    shutil.rmtree(patch_paths[0])
+    json_path = patch_paths[1] / f"{patch_paths[1].name}_labels_metadata.json"
+    data = json.loads(json_path.read_text())
+    data["labels"] = ["Pastures"]
+    json_path.write_text(json.dumps(data))
+
+    build_raw_ben_s2_parquet(ben_path, output_path=output_path, incremental=True)
+    gdf = geopandas.read_parquet(output_path)
+    ref_gdf = get_gdf_from_s2_patch_dir(ben_path)
+    geopandas.testing.assert_geodataframe_equal(gdf, ref_gdf)
+    assert patch_paths[0].name not in gdf["name"].tolist()
+
+
+@pytest.mark.parametrize("row_group_size", [None, 4])
+def test_manifest_is_gathered_by_workers(
+    tmp_path, monkeypatch, test_dataset_path, row_group_size
+):
+    ref_manifest = _get_patch_manifest(discover_s2_patch_directories(test_dataset_path))
+    # the parent process must not collect the file statistics itself
+    monkeypatch.setattr("bigearthnet_gdf_builder.builder._get_patch_manifest", None)
+    output_path = build_raw_ben_s2_parquet(
+        test_dataset_path,
+        output_path=tmp_path / "raw_ben_gdf.parquet",
+        n_workers=2,
+        row_group_size=row_group_size,
+    )
+    manifest = pd.read_parquet(output_path.with_suffix(".manifest.parquet"))
+    pd.testing.assert_frame_equal(manifest, ref_manifest)
+    assert "json_size" not in pq.read_schema(output_path).names
+
+
+def test_incremental_build_of_other_sensor(
+    tmp_path, test_dataset_path, test_dataset_s1_path
+):
+    output_path = tmp_path / "raw_ben_gdf.parquet"
+    build_raw_ben_s2_parquet(test_dataset_path, output_path=output_path, n_workers=1)
+    build_raw_ben_s1_parquet(
+        test_dataset_s1_path, output_path=output_path, n_workers=1, incremental=True
+    )
+    gdf = geopandas.read_parquet(output_path)
+    geopandas.testing.assert_geodataframe_equal(
+        gdf, get_gdf_from_s1_patch_dir(test_dataset_s1_path)
+    )
+
+    # a previous build with other columns is not reused, even with the same sensor
+    prev_gdf = gdf.assign(tile_source=None)
+    prev_gdf.to_parquet(output_path)
+    build_raw_ben_s1_parquet(
+        test_dataset_s1_path, output_path=output_path, n_workers=1, incremental=True
+    )
+    assert "tile_source" not in geopandas.read_parquet(output_path).columns
+
+
+@pytest.mark.parametrize("row_group_size", [1, 4, 1024])
+def test_build_raw_s2_parquet_streaming(tmp_path, test_dataset_path, row_group_size):
+    p = build_raw_ben_s2_parquet(
+        test_dataset_path,
+        output_path=tmp_path / "raw_ben_gdf.parquet",
+        n_workers=2,
+        row_group_size=row_group_size,
+    )
+    gdf = geopandas.read_parquet(p)
+    ref_gdf = get_gdf_from_s2_patch_dir(test_dataset_path)
+    geopandas.testing.assert_geodataframe_equal(gdf, ref_gdf)
+    n_row_groups = pq.ParquetFile(p).num_row_groups
+    assert n_row_groups == math.ceil(len(ref_gdf) / row_group_size)
+
+
+def test_write_compact_chunks_with_growing_categories(tmp_path):
+    dates = pd.date_range("2017-06-01", periods=210, freq="D").astype(str)
+    gdfs = [
+        geopandas.GeoDataFrame(
+            {
+                "name": [f"patch_{i}" for i in idx],
+                "acquisition_date": pd.Categorical(dates[idx]),
+            },
+            geometry=[Point(i, i) for i in idx],
+            crs="epsg:3035",
+        )
+        for idx in [np.arange(10), np.arange(10, 210)]
+    ]
+    output_path = tmp_path / "chunks.parquet"
+    assert _write_gdf_chunks_to_parquet(gdfs, output_path, row_group_size=64) == 210
+    gdf = geopandas.read_parquet(output_path)
+    assert gdf["acquisition_date"].astype(str).tolist() == dates.tolist()
+
+
+@pytest.mark.parametrize("row_group_size", [None, 4])
+@pytest.mark.parametrize("mode", ["w", "w:gz"])
+def test_build_raw_parquet_from_tar(
+    tmp_path, test_dataset_path, test_dataset_s1_path, mode, row_group_size
+):
+    for dataset_path, builder, ref_builder in [
+        (test_dataset_path, build_raw_ben_s2_parquet, get_gdf_from_s2_patch_dir),
+        (test_dataset_s1_path, build_raw_ben_s1_parquet, get_gdf_from_s1_patch_dir),
+    ]:
+        tar_path = tmp_path / f"{dataset_path.name}.tar"
+        with tarfile.open(tar_path, mode) as tar:
+            tar.add(dataset_path, arcname=dataset_path.name)
+        p = builder(
+            tar_path,
+            output_path=tmp_path / f"{dataset_path.name}.parquet",
+            row_group_size=row_group_size,
+        )
+        gdf = geopandas.read_parquet(p).sort_values("name", ignore_index=True)
+        ref_gdf = ref_builder(dataset_path).sort_values("name", ignore_index=True)
+        geopandas.testing.assert_geodataframe_equal(gdf, ref_gdf)
+
+    with pytest.raises(ValueError):
+        build_raw_ben_s2_parquet(tar_path, incremental=True)
+
+
+def test_sharded_build_and_merge(tmp_path, test_dataset_path):
+    output_path = tmp_path / "raw_ben_gdf.parquet"
+    procs = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "bigearthnet_gdf_builder.builder",
+                "build-raw-ben-s2-parquet",
+                str(test_dataset_path),
+                "--output-path",
+                str(output_path),
+                "--n-workers",
+                "1",
+                "--shard-index",
+                str(i),
+                "--num-shards",
+                "3",
+            ]
+        )
+        for i in range(3)
+    ]
+    assert all(proc.wait() == 0 for proc in procs)
+    assert not output_path.exists()
+
+    merge_raw_ben_parquet_parts(output_path)
+    gdf = geopandas.read_parquet(output_path)
+    ref_gdf = get_gdf_from_s2_patch_dir(test_dataset_path)
+    ref_gdf = ref_gdf.sort_values("name", ignore_index=True)
+    geopandas.testing.assert_geodataframe_equal(gdf, ref_gdf)
+    assert pd.read_parquet(output_path.with_suffix(".manifest.parquet"))[
+        "name"
+    ].tolist() == sorted(ref_gdf["name"])
+
+
+def test_merge_checks_parts(tmp_path, test_dataset_path, test_dataset_s1_path):
+    output_path = tmp_path / "raw_ben_gdf.parquet"
+    for i in range(2):
+        build_raw_ben_s2_parquet(
+            test_dataset_path,
+            output_path=output_path,
+            n_workers=1,
+            compact=True,
+            shard_index=i,
+            num_shards=2,
+        )
+    gdf = geopandas.read_parquet(merge_raw_ben_parquet_parts(output_path))
+    assert isinstance(gdf["tile_source"].dtype, pd.CategoricalDtype)
+    assert gdf["name"].is_monotonic_increasing
+
+    with pytest.raises(ValueError):
+        build_raw_ben_s2_parquet(test_dataset_path, shard_index=2, num_shards=2)
+    with pytest.raises(ValueError):
+        merge_raw_ben_parquet_parts(tmp_path / "missing.parquet")
+    # a part of another shard count is ambiguous
+    build_raw_ben_s1_parquet(
+        test_dataset_s1_path,
+        output_path=output_path,
+        n_workers=1,
+        shard_index=0,
+        num_shards=1,
+    )
+    with pytest.raises(ValueError):
+        merge_raw_ben_parquet_parts(output_path)
+    # S1 parts do not share the schema of the S2 parts
+    s1_part = output_path.with_name("raw_ben_gdf.part-00000-of-00001.parquet")
+    s1_part.rename(output_path.with_name("raw_ben_gdf.part-00001-of-00002.parquet"))
+    with pytest.raises(ValueError, match="Schema"):
+        merge_raw_ben_parquet_parts(output_path)
+
+
+def test_assign_to_ben_country_matches_nearest_join(
+    ben_borders_path, test_dataset_path
+):
+    cache_ben_countries(ben_borders_path, verbose=False)
+    gdf = get_gdf_from_s2_patch_dir(test_dataset_path)
+    points = geopandas.GeoDataFrame(
+        geometry=[
+            Point(14.0, 47.5),  # Austria
+            Point(9.5, 47.0),  # Austria/Switzerland border
+            Point(-12.0, 40.0),  # Atlantic ocean
+            Point(8.0, 52.0),  # Germany, is not a BEN country
+        ],
+        crs="epsg:4326",
+        index=[10, 11, 10, 12],
+    ).to_crs("epsg:3035")
+    for g in [gdf, points]:
+        centroids = geopandas.GeoDataFrame(geometry=g.geometry.centroid)
+        nn_gdf = centroids.reset_index(drop=True).sjoin_nearest(
+            get_ben_countries_gdf("epsg:3035"), how="inner"
+        )
+        ref = nn_gdf[~nn_gdf.index.duplicated()].sort_index()["NAME"].tolist()
+        assert assign_to_ben_country(g.copy())["country"].tolist() == ref
+
+
+def test_get_tile_ids(test_dataset_path, test_dataset_s1_path):
+    gdf = get_gdf_from_s2_patch_dir(test_dataset_path)
+    assert set(_get_tile_ids(gdf)) == {
+        "29UPU",
+        "29SND",
+        "34TEP",
+        "34TEQ",
+        "35VLC",
+        "35VNH",
+        "35VPK",
+        "35WPN",
+    }
+    gdf_s1 = get_gdf_from_s1_patch_dir(test_dataset_s1_path)
+    assert _get_tile_ids(gdf_s1).tolist() == ["33UUP"] * 3
+    assert _get_tile_ids(pd.DataFrame({"city": ["Vienna"]})).tolist() == [None]
+
+
+def test_assign_to_ben_country_tile_table(ben_borders_path, test_dataset_path):
+    cache_ben_countries(ben_borders_path, verbose=False)
+    gdf = get_gdf_from_s2_patch_dir(test_dataset_path)
+    ref = assign_to_ben_country(gdf.copy(), simplify_tolerance=0)["country"]
+    countries = assign_to_ben_country(gdf.copy())["country"]
+    pandas.testing.assert_series_equal(countries, ref)
+
+    table_path = _tile_table_path("epsg:3035")
+    # the table is replaced atomically without leaving temporary files behind
+    assert {p.name for p in table_path.parent.glob("tmp*")} == set()
+    table = pd.read_parquet(table_path).set_index("tile")
+    assert table.loc["29SND", "country"] == "Portugal"
+    assert table["country"].isna().sum() == len(table) - 1
+    # the second run is served from the stored table
+    pandas.testing.assert_series_equal(
+        assign_to_ben_country(gdf.copy())["country"], ref
+    )